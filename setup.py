@@ -49,6 +49,8 @@ setup(
     packages=["roamrs"],
     package_dir={"": "src"},
     install_requires=["aiohttp", "aiostream >= 0.3.3"],
+    extras_require={"uvloop": ["uvloop"]},
+    entry_points={"console_scripts": ["roamrs-loadgen = roamrs.loadgen:main"]},
     python_requires=">=3.7",
     cmdclass={"verify": VerifyVersionCommand},
 )
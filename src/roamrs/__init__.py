@@ -3,6 +3,9 @@ from .extensions import Extension
 from .services import Service
 from .common import Method
 from .cog import Cog, route
+from .cache import SharedAuthCache
+from .broadcast import BroadcastHub
+from .cors import CORSConfig
 
 __all__ = (
     "HTTPServer",
@@ -15,4 +18,7 @@ __all__ = (
     "Service",
     "Cog",
     "route",
+    "SharedAuthCache",
+    "BroadcastHub",
+    "CORSConfig",
 )
@@ -1,13 +1,181 @@
+import asyncio
+import logging
+import time
+
+from collections import deque
+from enum import Enum
+
 from .services import AuthService
-from aiohttp import ClientSession
-from typing import Any, Dict
+from .cache import LocalAuthCache
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+from typing import Any, Dict, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CircuitState(Enum):
+    """The states a :class:`CircuitBreaker` can be in"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class OpenCircuitPolicy(Enum):
+    """What a :class:`TokenValidator` does when it can't reach the auth server
+
+    FAIL_FAST responds with a 503 straight away. SERVE_CACHED uses the last result
+    for the token if it was cached within the grace window, and responds with a
+    503 if it wasn't.
+    """
+
+    FAIL_FAST = "fail_fast"
+    SERVE_CACHED = "serve_cached"
+
+
+class CircuitBreaker:
+    """Stops calls to a backend that keeps failing, so that it isn't swamped
+    while it recovers and callers don't wait on it.
+
+    The breaker starts closed and records the outcome of the last `window` calls.
+    Once at least `min_calls` have been made and the fraction that failed reaches
+    `failure_rate`, the breaker opens and refuses calls. After `reset_timeout`
+    seconds it becomes half open and lets `half_open_calls` calls through, if they
+    succeed it closes again, if one fails it opens again. A call that was let
+    through but never finished (e.g. it was cancelled) is handed back with
+    :meth:`release`, so it counts neither way.
+
+    Args:
+      failure_rate: The fraction of failed calls that opens the breaker.
+      window: How many of the most recent calls the failure rate is taken over.
+      min_calls: How many calls must be recorded before the breaker can open.
+      reset_timeout: How many seconds the breaker stays open for.
+      half_open_calls: How many trial calls are let through when half open.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_calls: int = 1,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self._outcomes = deque(maxlen=window)
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        # trial calls let through and trial calls that succeeded while half open
+        self._trials = 0
+        self._trial_successes = 0
+
+    @property
+    def state(self) -> CircuitState:
+        """The current state of the breaker"""
+        if (
+            self._state is CircuitState.OPEN
+            and time.monotonic() - self._opened_at >= self.reset_timeout
+        ):
+            self._state = CircuitState.HALF_OPEN
+            self._trials = 0
+            self._trial_successes = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """Check if a call may be made, call :meth:`record_success`,
+        :meth:`record_failure` or :meth:`release` with the outcome if it is made.
+        """
+        state = self.state
+        if state is CircuitState.CLOSED:
+            return True
+        if state is CircuitState.HALF_OPEN and self._trials < self.half_open_calls:
+            self._trials += 1
+            return True
+        return False
+
+    def record_success(self):
+        if self._state is CircuitState.HALF_OPEN:
+            self._trial_successes += 1
+            if self._trial_successes >= self.half_open_calls:
+                LOGGER.info("Circuit closed")
+                self._state = CircuitState.CLOSED
+                self._outcomes.clear()
+            return
+        self._outcomes.append(True)
+
+    def release(self):
+        """Hand back a call that was allowed but has no outcome, e.g. because it
+        was cancelled, freeing its trial slot if the breaker is half open.
+        """
+        if self._state is CircuitState.HALF_OPEN and self._trials > 0:
+            self._trials -= 1
+
+    def record_failure(self):
+        if self._state is CircuitState.HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(False)
+        if len(self._outcomes) >= self.min_calls:
+            failures = self._outcomes.count(False)
+            if failures / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        LOGGER.warning("Circuit opened, refusing calls for %ss", self.reset_timeout)
+        self._state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
 
 
 class TokenValidator(AuthService):
+    """An auth service that checks tokens against a Roam.gg style auth server.
+
+    Every call to the auth server is limited by `timeout` and goes through a
+    :class:`CircuitBreaker`. When a call fails, times out or the breaker is open,
+    `open_policy` decides what happens.
+
+    Args:
+      url: The base url of the auth server.
+      cache: An optional cache, such as :class:`.cache.SharedAuthCache`, to keep
+        the results of '/verify' and '/get_user' in.
+      timeout: The number of seconds a call to the auth server may take.
+      breaker: The circuit breaker to use, a default one is made if not given.
+      open_policy: What to do when the auth server can't be reached.
+      grace: How many seconds after a cached result expired it may still be used
+        with :attr:`OpenCircuitPolicy.SERVE_CACHED`.
+      *args: Passed to the :class:`aiohttp.ClientSession`.
+      **kwargs: Passed to the :class:`aiohttp.ClientSession`.
+    """
+
     __slots__ = "url"
 
-    def __init__(self, _, __, url, *args, **kwargs):
+    def __init__(
+        self,
+        _,
+        __,
+        url,
+        *args,
+        cache=None,
+        timeout: float = 10.0,
+        breaker: CircuitBreaker = None,
+        open_policy: OpenCircuitPolicy = OpenCircuitPolicy.FAIL_FAST,
+        grace: float = 300.0,
+        **kwargs,
+    ):
         self.url = url.rstrip("/")
+        self.cache = cache
+        self.timeout = ClientTimeout(total=timeout)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.open_policy = open_policy
+        self.grace = grace
+        # Results are only read back from this cache when the auth server can't
+        # be reached, so they expire straight away.
+        self._fallback_cache = cache
+        if cache is None and open_policy is OpenCircuitPolicy.SERVE_CACHED:
+            self._fallback_cache = LocalAuthCache(ttl=0)
         self.__args = args
         self.__kwargs = kwargs
         self.__session = None
@@ -16,24 +184,94 @@ class TokenValidator(AuthService):
         if not self.__session:
             self.__session = ClientSession(*self.__args, **self.__kwargs)
 
-    async def __call__(self, auth_str: str) -> bool:
+    async def close(self):
+        """Close the session used to reach the auth server"""
+        if self.__session:
+            await self.__session.close()
+            self.__session = None
+
+    def _unavailable(self, endpoint: str, auth_str: str) -> Any:
+        if self.open_policy is OpenCircuitPolicy.SERVE_CACHED:
+            found, value = self._fallback_cache.get(endpoint, auth_str, self.grace)
+            if found:
+                return value
+        raise web.HTTPServiceUnavailable(text="Authorization is unavailable")
+
+    async def _request(
+        self, endpoint: str, auth_str: str, read_json: bool = False
+    ) -> Tuple[int, Any]:
+        """Call an endpoint of the auth server through the breaker.
+
+        Returns the status and, if `read_json` is set and the status is 200, the
+        body. If the call fails the status is None and the value comes from the
+        open policy.
+        """
+        if not self.breaker.allow():
+            return None, self._unavailable(endpoint, auth_str)
         await self._create_session()
-        async with self.__session.get(
-            self.url + "/verify", headers={"Authorization": auth_str}
-        ) as resp:
-            if resp.status == 200:
-                return True
-            if resp.status == 401:
-                return False
+        try:
+            async with self.__session.get(
+                f"{self.url}/{endpoint}",
+                headers={"Authorization": auth_str},
+                timeout=self.timeout,
+            ) as resp:
+                if resp.status >= 500:
+                    raise ClientError(f"auth server responded with {resp.status}")
+                body = None
+                if read_json and resp.status == 200:
+                    body = await resp.json()
+        except (asyncio.TimeoutError, ClientError) as e:
+            LOGGER.warning("Call to %s/%s failed: %r", self.url, endpoint, e)
+            self.breaker.record_failure()
+            return None, self._unavailable(endpoint, auth_str)
+        except asyncio.CancelledError:
+            # The client went away or the handler timed out, that says nothing
+            # about the auth server
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return resp.status, body
+
+    def _store(self, endpoint: str, auth_str: str, value: Any):
+        if self._fallback_cache is not None:
+            self._fallback_cache.set(endpoint, auth_str, value)
+
+    async def __call__(self, auth_str: str) -> bool:
+        if self.cache is not None:
+            found, verdict = self.cache.get("verify", auth_str)
+            if found:
+                return verdict
+        status, verdict = await self._request("verify", auth_str)
+        if status is None:
+            # The auth server couldn't be reached, so this came from the cache
+            return verdict
+        if status == 200:
+            verdict = True
+        elif status == 401:
+            verdict = False
+        else:
+            # Don't cache errors from the auth server
             return False
+        self._store("verify", auth_str, verdict)
+        return verdict
 
     async def get_user(self, auth_str: str) -> Dict[str, Any]:
-        await self._create_session()
-        async with self.__session.get(
-            self.url + "/get_user", headers={"Authorization": auth_str}
-        ) as resp:
-            if resp.status == 200:
-                return await resp.json()
-            if resp.status == 401:
-                return None
+        if self.cache is not None:
+            found, user = self.cache.get("get_user", auth_str)
+            if found:
+                return user
+        status, user = await self._request("get_user", auth_str, read_json=True)
+        if status is None:
+            return user
+        if status == 401:
+            user = None
+        elif status != 200:
             return None
+        self._store("get_user", auth_str, user)
+        return user
@@ -0,0 +1,221 @@
+"""This module provides a hub that pushes messages to clients connected with
+Server-Sent Events or WebSockets, so they don't have to poll for updates.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+
+from typing import Any, Dict, Iterable, Optional, Set
+
+from .extensions import Extension
+from .services import Service
+
+LOGGER = logging.getLogger(__name__)
+
+__all__ = ("BroadcastHub", "Message", "Subscription")
+
+
+class Message:
+    """A message published to a topic of a :class:`BroadcastHub`
+
+    The message is only serialized once, no matter how many subscribers it is
+    sent to.
+
+    Attributes:
+      topic: The topic the message was published to.
+      data: The data of the message, strings are sent as they are, anything else
+        is encoded as JSON.
+      event: The name of the event for Server-Sent Events.
+    """
+
+    __slots__ = ("topic", "data", "event", "_text", "_sse")
+
+    def __init__(self, topic: str, data: Any, event: Optional[str] = None):
+        self.topic = topic
+        self.data = data
+        self.event = event
+        self._text = None
+        self._sse = None
+
+    @property
+    def text(self) -> str:
+        """The message as text, for WebSockets"""
+        if self._text is None:
+            if isinstance(self.data, str):
+                self._text = self.data
+            else:
+                self._text = json.dumps(self.data)
+        return self._text
+
+    @property
+    def sse(self) -> bytes:
+        """The message framed as a Server-Sent Event"""
+        if self._sse is None:
+            lines = []
+            if self.event is not None:
+                lines.append(f"event: {self.event}")
+            lines.extend(f"data: {line}" for line in self.text.split("\n"))
+            self._sse = ("\n".join(lines) + "\n\n").encode("UTF-8")
+        return self._sse
+
+
+class Subscription:
+    """The messages of some topics of a :class:`BroadcastHub` for one connection
+
+    Iterate over a subscription with ``async for`` to receive its messages. If
+    the connection doesn't keep up and more than `max_buffer` messages are
+    waiting, the subscription is dropped and the iteration ends.
+
+    Attributes:
+      topics: The topics this subscription receives messages from.
+      dropped: If the subscription was closed because it fell behind.
+      closed: If the subscription has been closed.
+    """
+
+    def __init__(self, hub: BroadcastHub, topics: Iterable[str], max_buffer: int):
+        self.topics = frozenset(topics)
+        self.dropped = False
+        self.closed = False
+        self._hub = hub
+        self._queue = asyncio.Queue(max_buffer)
+
+    def _offer(self, message: Message) -> bool:
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            LOGGER.info("Dropping subscription to %s, it fell behind", self.topics)
+            self.dropped = True
+            self.close()
+            return False
+        return True
+
+    def close(self):
+        """Stop receiving messages, any waiting messages are discarded"""
+        if self.closed:
+            return
+        self.closed = True
+        self._hub.unsubscribe(self)
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        # wake up anyone waiting for a message
+        self._queue.put_nowait(None)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Message]:
+        """Wait for the next message
+
+        Args:
+          timeout: How many seconds to wait for.
+
+        Returns:
+          Optional[Message]: The message, or None if the subscription was closed
+
+        Raises:
+          asyncio.TimeoutError: No message arrived before the timeout.
+        """
+        if self.closed and self._queue.empty():
+            return None
+        if timeout is None:
+            return await self._queue.get()
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Message:
+        message = await self.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+
+class BroadcastHub(Extension):
+    """An extension that fans messages out to subscribers of topics
+
+    Register the hub as an extension so that services and handlers can publish
+    to it, then use :meth:`.context.Context.event_stream` or
+    :meth:`.context.Context.websocket` in a handler to push the messages of some
+    topics to a client.
+
+    Args:
+      max_buffer: The default number of messages that may be waiting for a
+        subscriber before it is dropped.
+    """
+
+    def __init__(self, max_buffer: int = 100):
+        super().__init__()
+        self.max_buffer = max_buffer
+        self.services = None
+        self.extensions = None
+        self._topics: Dict[str, Set[Subscription]] = {}
+
+    async def __call__(
+        self, services: Dict[str, Service], extensions: Dict[str, Extension]
+    ):
+        self.services = services
+        self.extensions = extensions
+
+    async def stop(self):
+        for subscribers in list(self._topics.values()):
+            for subscription in list(subscribers):
+                subscription.close()
+
+    def subscribe(
+        self, topics: Iterable[str], max_buffer: Optional[int] = None
+    ) -> Subscription:
+        """Subscribe to some topics
+
+        Args:
+          topics: The topics to receive the messages of.
+          max_buffer: The number of messages that may be waiting before the
+            subscription is dropped, defaults to the hub's max_buffer.
+
+        Returns:
+          Subscription: The new subscription
+        """
+        if isinstance(topics, str):
+            topics = (topics,)
+        subscription = Subscription(
+            self, topics, self.max_buffer if max_buffer is None else max_buffer
+        )
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Stop a subscription from receiving messages
+
+        Args:
+          subscription: The subscription to remove
+        """
+        for topic in subscription.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[topic]
+
+    def subscribers(self, topic: str) -> int:
+        """Get the number of subscribers of a topic"""
+        return len(self._topics.get(topic, ()))
+
+    def publish(self, topic: str, data: Any, event: Optional[str] = None) -> int:
+        """Send a message to every subscriber of a topic
+
+        Args:
+          topic: The topic to publish to.
+          data: The data of the message, it must be a string or JSON serializable.
+          event: The name of the event for Server-Sent Events.
+
+        Returns:
+          int: The number of subscribers the message was queued for
+        """
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return 0
+        message = Message(topic, data, event)
+        # _offer may drop (and so unsubscribe) a subscriber, so iterate a copy
+        return sum(s._offer(message) for s in list(subscribers))
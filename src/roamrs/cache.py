@@ -0,0 +1,297 @@
+"""This module provides caches for the results of :class:`.services.AuthService`
+calls so that a token does not have to be verified with the auth backend on
+every single request.
+"""
+import errno
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Any, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not a POSIX platform
+    fcntl = None
+
+__all__ = ("LocalAuthCache", "SharedAuthCache")
+
+
+def _default_path():
+    # /dev/shm is a tmpfs on linux, so the mapping never touches the disk
+    name = f"roamrs-auth-cache-{os.geteuid()}"
+    if os.path.isdir("/dev/shm"):
+        return os.path.join("/dev/shm", name)
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+class SharedAuthCache:
+    """A fixed size hash table stored in a memory mapped file that every worker
+    process on a host can open, so they all share one cache of auth results.
+
+    Each slot is guarded by a sequence counter. Writers take a POSIX record lock
+    on the file, which belongs to the process, so workers forked after the cache
+    was opened still exclude each other, and bump the counter before and after changing the slot, readers never lock,
+    they just retry if the counter changed while they were reading. A reader
+    gives up on a slot that stays mid-write for too long (e.g. its writer died)
+    and treats it as a miss, the next write to the slot repairs it.
+
+    Keys are hashed before they are stored, so tokens are never written to the
+    shared segment. Values must be JSON serializable. As anyone who can write to
+    the file can forge auth results, it must belong to the user running the server
+    and must not be writable by anyone else.
+
+    Args:
+      path: The file to map, all processes that want to share the cache must
+        use the same path.
+      slots: The number of entries the table can hold.
+      value_size: The largest JSON encoded value (in bytes) that can be stored,
+        larger values are not cached.
+      ttl: The default number of seconds an entry is valid for.
+      probes: How many neighbouring slots to look through when the slot a key
+        hashes to is taken.
+
+    Raises:
+      ValueError: The file already exists but was created with a different
+        layout.
+      PermissionError: The file belongs to another user, can be written to by
+        other users, or is a symbolic link.
+    """
+
+    _MAGIC = b"RRSAUTH1"
+    _FILE_HEADER = struct.Struct("<8sII")
+    # seq, key digest, expires at, value length
+    _SLOT_HEADER = struct.Struct("<I4x16sdI4x")
+    _SEQ = struct.Struct("<I")
+    # How many times a reader retries a slot that is being written to
+    _READ_ATTEMPTS = 1000
+
+    def __init__(
+        self,
+        path: str = None,
+        slots: int = 4096,
+        value_size: int = 1024,
+        ttl: float = 30.0,
+        probes: int = 8,
+    ):
+        if fcntl is None:
+            raise RuntimeError("SharedAuthCache requires a POSIX platform")
+        if slots < 1 or value_size < 1:
+            raise ValueError("slots and value_size must be positive")
+        self.path = path or _default_path()
+        self.slots = slots
+        self.value_size = value_size
+        self.ttl = ttl
+        self.probes = min(probes, slots)
+        # keep every slot 8 byte aligned
+        self._slot_size = (self._SLOT_HEADER.size + value_size + 7) & ~7
+        size = self._FILE_HEADER.size + self._slot_size * slots
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        except OSError as e:
+            if e.errno == errno.ELOOP:
+                raise PermissionError(f"{self.path} is a symbolic link")
+            raise
+        stat = os.fstat(self._fd)
+        if stat.st_uid != os.geteuid() or stat.st_mode & 0o022:
+            os.close(self._fd)
+            raise PermissionError(
+                f"{self.path} must belong to this user and not be writable by others"
+            )
+        self._lock()
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(
+                    self._fd,
+                    self._FILE_HEADER.pack(self._MAGIC, slots, value_size),
+                    0,
+                )
+            header = os.pread(self._fd, self._FILE_HEADER.size, 0)
+        finally:
+            self._unlock()
+        if self._FILE_HEADER.unpack(header) != (self._MAGIC, slots, value_size):
+            os.close(self._fd)
+            raise ValueError(
+                f"{self.path} holds a cache with a different layout, "
+                "remove it or use another path"
+            )
+        self._map = mmap.mmap(self._fd, size)
+
+    def _lock(self):
+        # lockf locks belong to the process, unlike flock locks which are shared
+        # by every process that inherited the descriptor through a fork
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _digest(namespace: str, key: str) -> bytes:
+        return blake2b(f"{namespace}\0{key}".encode("UTF-8"), digest_size=16).digest()
+
+    def _offsets(self, digest: bytes):
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        for i in range(self.probes):
+            yield (
+                self._FILE_HEADER.size + ((start + i) % self.slots) * self._slot_size
+            )
+
+    def _read_slot(self, offset: int):
+        header_size = self._SLOT_HEADER.size
+        for _ in range(self._READ_ATTEMPTS):
+            seq = self._SEQ.unpack_from(self._map, offset)[0]
+            if seq & 1:
+                # a writer is half way through this slot
+                continue
+            _, digest, expires, length = self._SLOT_HEADER.unpack_from(
+                self._map, offset
+            )
+            value = self._map[offset + header_size : offset + header_size + length]
+            if self._SEQ.unpack_from(self._map, offset)[0] == seq:
+                return digest, expires, value
+        # the slot was torn by a writer that died, or is being hammered
+        return None
+
+    def _write_slot(self, offset: int, digest: bytes, expires: float, value: bytes):
+        # Must hold the lock. The counter is forced even first, so a slot left
+        # odd by a writer that died half way through is repaired.
+        seq = self._SEQ.unpack_from(self._map, offset)[0] & ~1
+        self._SEQ.pack_into(self._map, offset, (seq + 1) & 0xFFFFFFFF)
+        self._SLOT_HEADER.pack_into(
+            self._map, offset, (seq + 1) & 0xFFFFFFFF, digest, expires, len(value)
+        )
+        start = offset + self._SLOT_HEADER.size
+        self._map[start : start + len(value)] = value
+        self._SEQ.pack_into(self._map, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def get(self, namespace: str, key: str, grace: float = 0.0) -> Tuple[bool, Any]:
+        """Look up a cached value
+
+        Args:
+          namespace: The kind of value being looked up, e.g. 'verify'.
+          key: The key the value was stored under.
+          grace: How many seconds after it expired an entry may still be returned.
+
+        Returns:
+          Tuple[bool, Any]: If the value was found and the value itself.
+        """
+        if key is None:
+            return False, None
+        digest = self._digest(namespace, key)
+        now = time.time()
+        for offset in self._offsets(digest):
+            slot = self._read_slot(offset)
+            if slot is None:
+                continue
+            slot_digest, expires, value = slot
+            if slot_digest == digest:
+                if now < expires + grace:
+                    return True, json.loads(value)
+                return False, None
+        return False, None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float = None) -> bool:
+        """Store a value in the cache
+
+        Args:
+          namespace: The kind of value being stored, e.g. 'verify'.
+          key: The key to store the value under.
+          value: A JSON serializable value.
+          ttl: How many seconds the value is valid for, defaults to the cache's ttl.
+
+        Returns:
+          bool: False if the value was too large to be cached.
+        """
+        if key is None:
+            return False
+        encoded = json.dumps(value, separators=(",", ":")).encode("UTF-8")
+        if len(encoded) > self.value_size:
+            return False
+        digest = self._digest(namespace, key)
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        self._lock()
+        try:
+            target = None
+            oldest = None
+            for offset in self._offsets(digest):
+                _, slot_digest, slot_expires, _ = self._SLOT_HEADER.unpack_from(
+                    self._map, offset
+                )
+                if slot_digest == digest:
+                    target = offset
+                    break
+                if target is None and slot_expires < now:
+                    target = offset
+                if oldest is None or slot_expires < oldest[1]:
+                    oldest = (offset, slot_expires)
+            if target is None:
+                target = oldest[0]
+            self._write_slot(target, digest, expires, encoded)
+        finally:
+            self._unlock()
+        return True
+
+    def clear(self):
+        """Remove every entry from the cache, for every process using it"""
+        self._lock()
+        try:
+            for i in range(self.slots):
+                offset = self._FILE_HEADER.size + i * self._slot_size
+                self._write_slot(offset, bytes(16), 0.0, b"")
+        finally:
+            self._unlock()
+
+    def close(self):
+        """Unmap the cache, the file is left in place for the other processes"""
+        self._map.close()
+        os.close(self._fd)
+
+
+class LocalAuthCache:
+    """An in-process cache of auth results with the same interface as
+    :class:`SharedAuthCache`, for when results don't need to be shared.
+
+    The least recently used entries are removed once the cache is full.
+
+    Args:
+      max_entries: The number of entries the cache can hold.
+      ttl: The default number of seconds an entry is valid for.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, namespace: str, key: str, grace: float = 0.0) -> Tuple[bool, Any]:
+        """Look up a cached value, see :meth:`SharedAuthCache.get`"""
+        entry = self._entries.get((namespace, key))
+        if entry is None or time.time() >= entry[0] + grace:
+            return False, None
+        self._entries.move_to_end((namespace, key))
+        return True, entry[1]
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float = None) -> bool:
+        """Store a value in the cache, see :meth:`SharedAuthCache.set`"""
+        if key is None:
+            return False
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        self._entries[(namespace, key)] = (expires, value)
+        self._entries.move_to_end((namespace, key))
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        self._entries.clear()
+
+    def close(self):
+        pass
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Coroutine
+from typing import Any, Coroutine
 from inspect import iscoroutinefunction
 
 from aiohttp import web
@@ -18,6 +18,7 @@ class RouteHolder:
     path: str
     method: Method
     cog: "Cog" = None
+    schema: Any = None
 
     @property
     def split_path(self):
@@ -60,10 +61,10 @@ class Cog(metaclass=CogMeta):
             server.router.remove_route(route.split_path)
 
 
-def route(path: str, method: Method):
+def route(path: str, method: Method, schema: Any = None):
     def route_dec(func):
         if not iscoroutinefunction(func):
             raise TypeError("handler for route must be a coroutine")
-        return RouteHolder(func, path, method)
+        return RouteHolder(func, path, method, schema=schema)
 
     return route_dec
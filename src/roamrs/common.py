@@ -11,6 +11,8 @@ class Method(Enum):
     POST = "POST"
     PATCH = "PATCH"
     DELETE = "DELETE"
+    HEAD = "HEAD"
+    OPTIONS = "OPTIONS"
 
 
 async def async_map(func, items):
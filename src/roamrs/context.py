@@ -1,23 +1,219 @@
-from dataclasses import dataclass
-from aiohttp import web
-from typing import Dict, Any
+import asyncio
+
+from aiohttp import web, WSCloseCode, WSMsgType
+from typing import Dict, Any, Awaitable, Callable
 
 from .services import Service
 from .extensions import Extension
+from .broadcast import Subscription
+from .tracing import RequestTrace
+from .cors import CORSConfig
+from .pagination import Paginator, Source
 
 
-@dataclass
 class Context:
-    raw_request: web.BaseRequest
-    url_data: Dict[str, str]
-    services: Dict[str, Service]
-    extensions: Dict[str, Extension]
-    sent_data: Dict[str, str]
-    user_data: Dict[str, Any] = None
+    """Everything a handler needs to know about a request
+
+    A context is created for every request, so it only holds references to what
+    the router already has. Handlers usually don't need it at all, they can ask
+    for url variables, the body, services and extensions as arguments, see
+    :mod:`.injection`.
+
+    Attributes:
+      raw_request: The request.
+      url_data: The values of the variables in the route, by name.
+      services: The services of the server, by name.
+      extensions: The extensions of the server, by name.
+      sent_data: The data sent with the request, JSON, the query or the raw text.
+      user_data: The user that made the request, if there are auth services.
+      body: The sent data checked against the route's schema, if it has one.
+      trace: The trace of the request.
+      cors: The server's configuration for cross origin requests, if any.
+    """
+
+    __slots__ = (
+        "raw_request",
+        "url_data",
+        "services",
+        "extensions",
+        "sent_data",
+        "user_data",
+        "body",
+        "trace",
+        "cors",
+    )
+
+    def __init__(
+        self,
+        raw_request: web.BaseRequest,
+        url_data: Dict[str, Any],
+        services: Dict[str, Service],
+        extensions: Dict[str, Extension],
+        sent_data: Dict[str, str],
+        user_data: Dict[str, Any] = None,
+        body: Any = None,
+        trace: RequestTrace = None,
+        cors: CORSConfig = None,
+    ):
+        self.raw_request = raw_request
+        self.url_data = url_data
+        self.services = services
+        self.extensions = extensions
+        self.sent_data = sent_data
+        self.user_data = user_data
+        self.body = body
+        self.trace = trace
+        self.cors = cors
+
+    def __repr__(self):
+        return (
+            f"<Context {self.raw_request.method} {self.raw_request.path} "
+            f"url_data={self.url_data!r}>"
+        )
+
+    def respond(
+        self, data: Dict[str, Any], content_type="application/json"
+    ) -> web.Response:
+        if self.raw_request.method == "HEAD":
+            # The body won't be sent, so don't bother serializing it
+            # but send the same Content-Type as the GET response would
+            if content_type == "application/json":
+                return web.Response(content_type=content_type, charset="utf-8")
+            return web.Response(content_type="text/plain", charset="utf-8")
+        if self.trace is not None:
+            with self.trace.span("serialize"):
+                return self._build_response(data, content_type)
+        return self._build_response(data, content_type)
 
     @staticmethod
-    def respond(data: Dict[str, Any], content_type="application/json") -> web.Response:
+    def _build_response(data, content_type):
         if content_type == "application/json":
             return web.json_response(data)
         else:
             return web.Response(text=data)
+
+    async def prepare(self, response: web.StreamResponse):
+        """Send the headers of a streaming response
+
+        The router adds the CORS headers to the responses handlers return, but a
+        streaming response has sent its headers by then, so they are added here.
+
+        Args:
+          response: The response to prepare.
+        """
+        if self.cors is not None:
+            self.cors.apply(self.raw_request, response)
+        await response.prepare(self.raw_request)
+
+    async def paginate(self, paginator: Paginator, source: Source) -> web.Response:
+        """Respond with the page of a source that the request's 'cursor' and
+        'limit' query parameters ask for, see :meth:`.pagination.Paginator.respond`
+
+        Args:
+          paginator: The paginator that signs the cursors.
+          source: The source of the items, e.g. an async generator of a service.
+        """
+        return await paginator.respond(self.raw_request, source)
+
+    async def stream_export(
+        self, paginator: Paginator, source: Source
+    ) -> web.StreamResponse:
+        """Stream every item of a source as newline delimited JSON, see
+        :meth:`.pagination.Paginator.export`
+
+        Args:
+          paginator: The paginator that serializes the items.
+          source: The source of the items, e.g. an async generator of a service.
+        """
+        return await paginator.export(self.raw_request, source, prepare=self.prepare)
+
+    async def event_stream(
+        self, subscription: Subscription, heartbeat: float = 15.0
+    ) -> web.StreamResponse:
+        """Push the messages of a subscription to the client as Server-Sent Events
+        until the client goes away or the subscription is closed.
+
+        Args:
+          subscription: The subscription to send the messages of, it is closed
+            when the stream ends.
+          heartbeat: How many seconds to wait for a message before sending a
+            comment to keep the connection alive.
+
+        Returns:
+          web.StreamResponse: The finished response, return it from the handler.
+        """
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                # stop reverse proxies from buffering the events
+                "X-Accel-Buffering": "no",
+            }
+        )
+        await self.prepare(response)
+        try:
+            while True:
+                try:
+                    message = await subscription.get(heartbeat)
+                except asyncio.TimeoutError:
+                    await response.write(b": keep-alive\n\n")
+                    continue
+                if message is None:
+                    break
+                await response.write(message.sse)
+        except ConnectionResetError:
+            pass
+        finally:
+            subscription.close()
+        return response
+
+    async def websocket(
+        self,
+        subscription: Subscription = None,
+        on_message: Callable[[web.WebSocketResponse, Any], Awaitable[None]] = None,
+        heartbeat: float = None,
+    ) -> web.WebSocketResponse:
+        """Upgrade the request to a WebSocket, pushing the messages of a
+        subscription to the client and passing the messages the client sends to
+        `on_message` until either side closes the socket.
+
+        Args:
+          subscription: The subscription to send the messages of, it is closed
+            when the socket closes. If the subscription is dropped for falling
+            behind, the socket is closed with code 1013.
+          on_message: A coroutine called with the socket and each message the
+            client sends.
+          heartbeat: How often to ping the client, in seconds.
+
+        Returns:
+          web.WebSocketResponse: The closed socket, return it from the handler.
+        """
+        ws = web.WebSocketResponse(heartbeat=heartbeat)
+        await self.prepare(ws)
+
+        async def forward():
+            try:
+                async for message in subscription:
+                    await ws.send_str(message.text)
+                if subscription.dropped:
+                    await ws.close(
+                        code=WSCloseCode.TRY_AGAIN_LATER, message=b"Too slow"
+                    )
+            except ConnectionResetError:
+                pass
+
+        forwarder = None
+        if subscription is not None:
+            forwarder = asyncio.ensure_future(forward())
+        try:
+            async for msg in ws:
+                if on_message is not None and msg.type in (
+                    WSMsgType.TEXT,
+                    WSMsgType.BINARY,
+                ):
+                    await on_message(ws, msg)
+        finally:
+            if forwarder is not None:
+                forwarder.cancel()
+                subscription.close()
+        return ws
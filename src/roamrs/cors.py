@@ -0,0 +1,102 @@
+"""This module provides the configuration for answering cross origin (CORS)
+requests from browsers.
+"""
+from typing import Dict, Iterable, Optional
+
+from aiohttp import web
+
+__all__ = ("CORSConfig",)
+
+
+class CORSConfig:
+    """Which origins may make cross origin requests to the server and what they
+    may send.
+
+    Preflight requests are answered by the router from the route tree, without
+    authorizing them or running any handlers. The header values are built once
+    here, so answering a preflight only has to look up the route.
+
+    Args:
+      allow_origins: The origins that may make requests, or '*' for any origin.
+      allow_headers: The request headers that may be sent. If not given the
+        headers a preflight asks for are allowed.
+      expose_headers: The response headers the browser may show to scripts.
+      allow_credentials: If requests may include cookies and Authorization headers.
+        Origins must then be listed, as any site could otherwise read the
+        responses to requests made with its visitors' credentials.
+      max_age: How many seconds browsers may cache a preflight response for.
+
+    Raises:
+      ValueError: Credentials are allowed from any origin.
+    """
+
+    def __init__(
+        self,
+        allow_origins: Iterable[str] = "*",
+        allow_headers: Optional[Iterable[str]] = None,
+        expose_headers: Iterable[str] = (),
+        allow_credentials: bool = False,
+        max_age: int = 600,
+    ):
+        if isinstance(allow_origins, str):
+            allow_origins = (allow_origins,)
+        self.allow_origins = frozenset(allow_origins)
+        self.allow_any_origin = "*" in self.allow_origins
+        if self.allow_any_origin and allow_credentials:
+            raise ValueError("Credentials can't be allowed from any origin ('*')")
+        self.allow_headers = None if allow_headers is None else ", ".join(allow_headers)
+        self.allow_credentials = allow_credentials
+        self._headers = {}
+        if expose_headers:
+            self._headers["Access-Control-Expose-Headers"] = ", ".join(expose_headers)
+        if allow_credentials:
+            self._headers["Access-Control-Allow-Credentials"] = "true"
+        self._preflight_headers = {"Access-Control-Max-Age": str(max_age)}
+        if allow_credentials:
+            self._preflight_headers["Access-Control-Allow-Credentials"] = "true"
+
+    def _origin_headers(self, origin: str) -> Optional[Dict[str, str]]:
+        if self.allow_any_origin:
+            return {"Access-Control-Allow-Origin": "*"}
+        if origin in self.allow_origins:
+            return {"Access-Control-Allow-Origin": origin, "Vary": "Origin"}
+        return None
+
+    def preflight(
+        self, request: web.BaseRequest, allow_header: str
+    ) -> Optional[Dict[str, str]]:
+        """Get the headers to answer a preflight request with
+
+        Args:
+          request: The preflight request.
+          allow_header: The methods the requested route allows.
+
+        Returns:
+          Optional[Dict[str, str]]: The headers, or None if the origin isn't allowed
+        """
+        headers = self._origin_headers(request.headers.get("Origin", ""))
+        if headers is None:
+            return None
+        headers.update(self._preflight_headers)
+        headers["Access-Control-Allow-Methods"] = allow_header
+        requested = request.headers.get("Access-Control-Request-Headers")
+        if self.allow_headers is not None:
+            headers["Access-Control-Allow-Headers"] = self.allow_headers
+        elif requested:
+            headers["Access-Control-Allow-Headers"] = requested
+        return headers
+
+    def apply(self, request: web.BaseRequest, response: web.StreamResponse):
+        """Add the CORS headers to the response of a cross origin request
+
+        Args:
+          request: The request.
+          response: The response to add the headers to.
+        """
+        origin = request.headers.get("Origin")
+        if origin is None:
+            return
+        headers = self._origin_headers(origin)
+        if headers is not None:
+            response.headers.update(headers)
+            response.headers.update(self._headers)
@@ -1,21 +1,30 @@
 """This module provides the HTTPServer which is the core of the package
 """
 import asyncio
+import json
 import re
 import logging
+import socket
 
 from enum import Enum
 from inspect import iscoroutinefunction
-from typing import List, Callable, Dict
+from typing import Any, List, Callable, Dict, Optional, Tuple
 from sys import stdout
+from uuid import UUID
 
 from aiohttp import web
+from aiohttp.log import access_logger
 from .extensions import Extension
 from .services import Service, AuthService
 from .auth import TokenValidator
 from .common import Method, async_map, async_all
 from .context import Context
 from .cog import Cog, RouteHolder
+from .profiling import RouteProfiler
+from .schema import ValidationError, compile_schema
+from .tracing import RequestTrace, TraceExporter
+from .cors import CORSConfig
+from .injection import build_plan
 
 LOGGER = logging.getLogger(__name__)
 if not LOGGER.handlers:
@@ -30,6 +39,36 @@ if not LOGGER.handlers:
 
 __all__ = ("HandlerExists", "RouteDoesNotExist", "Route", "Router", "HTTPServer")
 
+_INT_PATTERN = re.compile(r"-?[0-9]+")
+
+
+def _convert_int(section: str) -> int:
+    if not _INT_PATTERN.fullmatch(section):
+        raise ValueError(f"{section} is not an integer")
+    return int(section)
+
+
+def _regex_converter(pattern: str) -> Callable[[str], str]:
+    compiled = re.compile(pattern)
+
+    def convert(section: str) -> str:
+        if not compiled.fullmatch(section):
+            raise ValueError(f"{section} does not match {pattern}")
+        return section
+
+    return convert
+
+
+# The converters for each type of variable route, and the priority they are tried
+# in when a route has more than one variable child, lowest first. Anything else
+# after the ':' of a variable route is treated as a regular expression.
+PATH_CONVERTERS = {
+    "int": (0, _convert_int),
+    "uuid": (1, UUID),
+    "str": (3, str),
+}
+_REGEX_PRIORITY = 2
+
 
 class HandlerExists(Exception):
     """An Exception that is raised when trying to add a handler that already
@@ -78,6 +117,13 @@ class Route:
     any string passed to it and pass the strings value to the handlers
     'url_data' parameter.
 
+    Variable routes can also be typed, '{user_id:int}' only matches integers and
+    passes the value as an int, '{user_id:uuid}' only matches uuids and passes a
+    :class:`uuid.UUID`. Anything else after the ':' is a regular expression the
+    whole section must match, e.g. '{code:[A-Z]{3}}'. A route can have several
+    variable children, fixed children are tried first, then the variable children
+    in the order: int, uuid, regular expressions, any string.
+
     Args:
       path: The endpoint that this route will be attributed to, this is only one
           section of a uri.
@@ -86,78 +132,301 @@ class Route:
       path: The endpoint that this route is attributed to, this is only one section
           of a uri.
       variable: If this route accepts any string instead of a specific one.
+      segment: The section of the uri this route was created from, e.g. '{id:int}'.
+      converter: The function that checks and converts the section of a uri for
+          a variable route, it raises ValueError if the section doesn't match.
+      priority: The order this route is tried in if it is variable, lowest first.
       handlers: A dictionary of handlers indexed by the method you can access them
           with.
+      invokers: The functions that call each handler with the arguments it asks
+          for, indexed by method, see :func:`.injection.build_plan`.
       children: The list of routes that are under this route. They are the 'b' to this 'a'.
-      variable_child: A route can only have one variable route under it, this is where it is stored.
+      variable_children: The variable routes under this route, sorted by priority.
+      validators: The compiled schema of each handler, indexed by method. None if the
+          handler does not have a schema.
+      allowed: The methods this route responds to. HEAD is allowed if there is a GET
+          handler and OPTIONS if there are any handlers, as they are answered for you.
+      allowed_methods: The names of the allowed methods, sorted.
+      allow_header: The allowed methods, ready to be sent in an Allow header.
+      template: The full path template of this route, e.g. '/users/{user_id}'.
     """
 
-    __slots__ = ("path", "handlers", "children", "variable", "variable_child")
+    __slots__ = (
+        "path",
+        "handlers",
+        "invokers",
+        "children",
+        "variable",
+        "segment",
+        "converter",
+        "priority",
+        "variable_children",
+        "validators",
+        "allowed",
+        "allowed_methods",
+        "allow_header",
+        "template",
+    )
 
     def __init__(self, path: str):
+        self.segment = path
+        self.converter = None
+        self.priority = 0
         if path != "":
-            ROUTE_PATTERN = re.compile(r"([A-Za-z0-9]+)|{([A-Za-z0-9.\-_]+)}")
-            match = ROUTE_PATTERN.match(path)
-            if not match:
-                raise ValueError(f'Invalid path "{path}" passed to route')
-            term, var = match.groups()
-            # This path looks like "some text" so it is not variable
-            if term is not None:
-                self.path = term
-                self.variable = False
+            name, kind = self.parse_segment(path)
+            self.path = name
+            self.variable = kind is not None
             # This path looks like "{some text}" so it is variable
-            else:
-                self.path = var
-                self.variable = True
+            if self.variable:
+                if kind in PATH_CONVERTERS:
+                    self.priority, self.converter = PATH_CONVERTERS[kind]
+                else:
+                    try:
+                        self.converter = _regex_converter(kind)
+                    except re.error as e:
+                        raise ValueError(
+                            f'Invalid pattern "{kind}" passed to route: {e}'
+                        )
+                    self.priority = _REGEX_PRIORITY
         # This is the root path (it's a bit weird)
         else:
             self.path = path
             self.variable = False
         self.handlers = {i: None for i in Method}
+        self.invokers = {i: None for i in Method}
+        self.validators = {i: None for i in Method}
+        self.allowed = frozenset()
+        self.allowed_methods = ()
+        self.allow_header = ""
         self.children = []
-        self.variable_child = None
+        self.variable_children = []
+        self.template = "/" + path
+
+    @staticmethod
+    def parse_segment(segment: str) -> Tuple[str, Optional[str]]:
+        """Split a section of a uri into its name and the type of the variable
+
+        Args:
+          segment: The section of the uri, like 'users', '{user_id}' or '{user_id:int}'
+
+        Returns:
+          Tuple[str, Optional[str]]: The name and the type, the type is None if
+            the section is not variable and 'str' if a variable has no type.
+
+        Raises:
+          ValueError: The section is not a valid path.
+        """
+        # This path looks like "{some text}" so it is variable
+        if segment.startswith("{") and segment.endswith("}"):
+            name, sep, kind = segment[1:-1].partition(":")
+            if re.fullmatch(r"[A-Za-z0-9.\-_]+", name) and (kind or not sep):
+                return name, kind or "str"
+        else:
+            match = re.match(r"[A-Za-z0-9]+", segment)
+            # This path looks like "some text" so it is not variable
+            if match:
+                return match.group(), None
+        raise ValueError(f'Invalid path "{segment}" passed to route')
+
+    def _find_child(self, segment: str) -> Optional["Route"]:
+        name, kind = self.parse_segment(segment)
+        if kind is None:
+            for child in self.children:
+                if child.path == name:
+                    return child
+            return None
+        for child in self.variable_children:
+            if child.path == name and self.parse_segment(child.segment)[1] == kind:
+                return child
+        return None
+
+    def _find_equivalent(self, path_list: List[str]) -> Optional["Route"]:
+        # Find a route with handlers under this one that matches exactly the same
+        # urls as path_list, variables of the same type match whatever their name
+        if not path_list:
+            return self if self.has_handlers else None
+        name, kind = self.parse_segment(path_list[0])
+        if kind is None:
+            candidates = [c for c in self.children if c.path == name]
+        else:
+            candidates = [
+                c
+                for c in self.variable_children
+                if self.parse_segment(c.segment)[1] == kind
+            ]
+        for child in candidates:
+            route = child._find_equivalent(path_list[1:])
+            if route is not None:
+                return route
+        return None
+
+    def check_shadowing(self, path_list: List[str]):
+        """Check that a route could be reached from this route, and that it won't
+        make an existing route unreachable
+
+        Variables of the same type (or with the same pattern) match the same
+        sections, so of two routes that only differ in the names of their
+        variables, only the one added first is ever matched.
+
+        Args:
+          path_list: The uri sections of the route, like ['items', '{slug}'].
+
+        Raises:
+          ValueError: A route that matches the same urls already has handlers.
+        """
+        route = self
+        for i, segment in enumerate(path_list):
+            name, kind = self.parse_segment(segment)
+            if kind is not None:
+                for sibling in route.variable_children:
+                    if (
+                        sibling.path == name
+                        or self.parse_segment(sibling.segment)[1] != kind
+                    ):
+                        continue
+                    other = sibling._find_equivalent(path_list[i + 1 :])
+                    if other is not None:
+                        raise ValueError(
+                            f'Route "/{"/".join(path_list)}" matches the same paths '
+                            f'as "{other.template}"'
+                        )
+            route = route._find_child(segment)
+            if route is None:
+                return
 
     @property
     def has_handlers(self):
-        return any(map(lambda x: x is not None, self.handlers.values()))
+        return bool(self.allowed)
 
-    async def __call__(
-        self, path_list: List[str], method: Method, ctx: Context
-    ) -> web.Response:
-        # If the remaining path list is empty then we must want this route!
-        if path_list == []:
-            if self.handlers[method]:
-                # let's get our result from our handler
-                return await self.handlers[method](ctx)
-            # uh oh! we don't have a handler for this method
-            if self.has_handlers:
-                allowed_methods = list(
-                    map(
-                        lambda x: x.value,
-                        filter(lambda x: self.handlers[x] is not None, self.handlers),
-                    )
-                )
-                raise web.HTTPMethodNotAllowed(
-                    allowed_methods=allowed_methods, method=method.value
-                )
+    def _update_allowed(self):
+        allowed = {m for m, h in self.handlers.items() if h is not None}
+        if allowed:
+            allowed.add(Method.OPTIONS)
+        if Method.GET in allowed:
+            allowed.add(Method.HEAD)
+        self.allowed = frozenset(allowed)
+        self.allowed_methods = tuple(sorted(m.value for m in allowed))
+        self.allow_header = ", ".join(self.allowed_methods)
+
+    def resolve(self, path_list: List[str], url_data: Dict[str, Any]) -> "Route":
+        """Find the route at the end of a path, filling in the values of any
+        variable routes on the way.
+
+        If a section matches more than one child the next one is tried when the
+        rest of the path doesn't match under the first.
+
+        Args:
+          path_list: The uri sections left to match, starting under this route.
+          url_data: The dictionary to store the values of variable routes in.
+
+        Returns:
+          Route: The route the path leads to
+
+        Raises:
+          HTTPNotFound: No route with handlers matches the path.
+        """
+        route = self._match(path_list, 0, url_data)
+        if route is None:
+            # Nothing matches, then what is the client requesting?
+            LOGGER.info("Nowhere found for: %s", path_list)
             raise web.HTTPNotFound()
-        # The path list isn't empty so the next section sould
-        # be a child right?
+        return route
+
+    def _match(
+        self, path_list: List[str], index: int, url_data: Dict[str, Any]
+    ) -> Optional["Route"]:
+        # If the remaining path list is empty then we must want this route!
+        if index == len(path_list):
+            return self if self.has_handlers else None
+        section = path_list[index]
+        # Is there a child with this exact path?
         for child in self.children:
-            if path_list[0] == child.path:
-                # Hey the path matches! let's get the result from the child.
-                return await child(path_list[1:], method, ctx)
-        # There wasn't a matching path? well is there a child we have that's
-        # variable?
-        if self.variable_child:
-            # Let's update the url_data parameter with this path.
-            ctx.url_data[self.variable_child.path] = path_list[0]
-            return await self.variable_child(path_list[1:], method, ctx)
-        # Wait there isn't a variable child either? Then what is the client
-        # requesting?
-        LOGGER.info("Nowhere found for: %s", path_list)
+            if section == child.path:
+                route = child._match(path_list, index + 1, url_data)
+                if route is not None:
+                    return route
+                break
+        # There wasn't a matching path? well is there a variable child that
+        # accepts it? They are sorted so the strictest is tried first.
+        for child in self.variable_children:
+            try:
+                value = child.converter(section)
+            except ValueError:
+                continue
+            route = child._match(path_list, index + 1, url_data)
+            if route is not None:
+                # Let's update the url_data parameter with the converted value.
+                url_data[child.path] = value
+                return route
+        return None
+
+    def get_handler(self, method: Method) -> Callable:
+        """Get the handler for a method on this route
+
+        Args:
+          method: The method of the request
+
+        HEAD requests are handled by the GET handler if there isn't a HEAD handler.
+
+        Returns:
+          The invoker of the handler for the method, it takes the context
+
+        Raises:
+          HTTPMethodNotAllowed: The route has handlers, but not for this method.
+          HTTPNotFound: The route has no handlers at all.
+        """
+        handler = self.invokers[method]
+        if handler:
+            return handler
+        if method is Method.HEAD and self.invokers[Method.GET]:
+            return self.invokers[Method.GET]
+        # uh oh! we don't have a handler for this method
+        if self.has_handlers:
+            raise self.method_not_allowed(method.value)
         raise web.HTTPNotFound()
 
+    def method_not_allowed(self, method: str) -> web.HTTPMethodNotAllowed:
+        """Create the exception for a method this route doesn't respond to
+
+        Args:
+          method: The method of the request
+        """
+        return web.HTTPMethodNotAllowed(
+            allowed_methods=self.allowed_methods, method=method
+        )
+
+    def validate(self, method: Method, ctx: Context):
+        """Check the data sent with a request against the schema of the handler
+        for a method, storing the result in the context's `body`
+
+        Args:
+          method: The method of the request
+          ctx: The context of the request
+
+        Raises:
+          HTTPBadRequest: The data does not match the schema.
+        """
+        validator = self.validators[method]
+        if method is Method.HEAD and self.handlers[Method.HEAD] is None:
+            validator = self.validators[Method.GET]
+        if validator is not None:
+            try:
+                ctx.body = validator(ctx.sent_data, ctx.url_data)
+            except ValidationError as e:
+                raise web.HTTPBadRequest(
+                    text=json.dumps({"errors": e.errors}),
+                    content_type="application/json",
+                )
+
+    async def __call__(
+        self, path_list: List[str], method: Method, ctx: Context
+    ) -> web.Response:
+        route = self.resolve(path_list, ctx.url_data)
+        handler = route.get_handler(method)
+        route.validate(method, ctx)
+        # let's get our result from our handler
+        return await handler(ctx)
+
     def add_route(self, path_list: List[str]) -> "Route":
         """Add a child route to this route. This creates any child routes
         nescesary to add the route you want to add.
@@ -174,40 +443,39 @@ class Route:
         Raises
         ------
         ValueError
-           If you try to add a variable child to this route when it already
-           has one
+           If a section of the path is not valid, or has an invalid pattern.
         """
         # Hey the path list is empty, that means me right?
         if path_list == []:
             return self
         # The path list is not empty, maybe a child has the next section?
-        for child in self.children:
-            if child.path == path_list[0]:
-                # This child does!
-                return child.add_route(path_list[1:])
-        # Does the endpoint belong under our variable child?
-        if self.variable_child and (
-            self.variable_child.path == path_list[0].strip("{}")
-        ):
-            return self.variable_child.add_route(path_list[1:])
+        child = self._find_child(path_list[0])
+        if child is not None:
+            # This child does!
+            return child.add_route(path_list[1:])
         # No, so let's add a new child to put the child under
         new_child = Route(path_list[0])
+        new_child.template = self.template.rstrip("/") + "/" + path_list[0]
         if new_child.variable:
-            if not self.variable_child:
-                self.variable_child = new_child
-            else:
-                # The new child is variable but we already have a
-                # variable child. wait...that's illegal.
-                raise ValueError("Route already has a variable child")
+            self.variable_children.append(new_child)
+            # sort is stable, so routes with the same priority stay in the
+            # order they were added
+            self.variable_children.sort(key=lambda r: r.priority)
         else:
             self.children.append(new_child)
         return new_child.add_route(path_list[1:])
 
-    def add_handler(self, holder: RouteHolder):
+    def add_handler(
+        self, holder: RouteHolder, validator: Callable = None, invoker: Callable = None
+    ):
         """Add a handler to a route under a given method
 
         Args:
           holder: The holder for the handler to add
+          validator: The compiled schema to check requests with before they are
+            passed to the handler
+          invoker: The function that calls the handler with the context, defaults
+            to the handler itself
 
         Raises:
           HandlerExists: A handler already exists under this method, you can't replace it.
@@ -217,33 +485,32 @@ class Route:
                 self.path, holder.method, self.handlers[holder.method], holder.func
             )
         self.handlers[holder.method] = holder.func
+        self.invokers[holder.method] = invoker or holder.func
+        self.validators[holder.method] = validator
+        self._update_allowed()
+
+    def _remove_child(self, child: "Route"):
+        if child.variable:
+            self.variable_children.remove(child)
+        else:
+            self.children.remove(child)
 
     def remove_route(self, path_list: List[str]) -> bool:
-        if len(path_list) == 1:
-            for i, c in enumerate(self.children):
-                if c.path == path_list[0]:
-                    del self.children[i]
-                    return True
-                if self.variable_child and (
-                    self.variable_child.path == path_list[0].strip("{}")
-                ):
-                    self.variable_child = None
-                    return True
+        if not path_list:
             return False
-        for i, child in enumerate(self.children):
-            if child.path == path_list[0]:
-                r = child.remove_route(path_list[1:])
-                if r:
-                    c = len(child.children) == 0
-                    h = all(map(lambda h: h == None, child.handlers.values()))
-                    if c and h:
-                        del self.children[i]
-                return r
-        if self.variable_child and (
-            self.variable_child.path == path_list[0].strip("{}")
-        ):
-            return self.variable_child.remove_route(path_list[1:])
-        return False
+        child = self._find_child(path_list[0])
+        if child is None:
+            return False
+        if len(path_list) == 1:
+            self._remove_child(child)
+            return True
+        r = child.remove_route(path_list[1:])
+        if r:
+            c = len(child.children) == 0 and len(child.variable_children) == 0
+            h = all(map(lambda h: h == None, child.handlers.values()))
+            if c and h:
+                self._remove_child(child)
+        return r
 
     def get_route(self, path_list: List[str]) -> "Route":
         """Get a route from a list of endpoints
@@ -259,11 +526,9 @@ class Route:
         """
         if path_list == []:
             return self
-        for child in self.children:
-            if path_list[0] == child.path:
-                return child.get_route(path_list[1:])
-        if self.variable_child:
-            return self.variable_child.get_route(path_list[1:])
+        child = self._find_child(path_list[0])
+        if child is not None:
+            return child.get_route(path_list[1:])
         raise RouteDoesNotExist(path_list)
 
 
@@ -274,22 +539,98 @@ class Router:
     You can either create your route yourself or let the HTTPServer do it for
     you.
 
+    Every request is traced with a :class:`.tracing.RequestTrace`, which is available
+    to handlers as the context's `trace`.
+
     Args:
       services
         The services that will available to handlers (and the router)
+      server_timing: If the timings of each request should be sent back in a
+        Server-Timing header.
+      trace_exporter: A function that is called with the trace of every finished
+        request.
+      cors: The configuration for cross origin requests, they are not answered
+        if it isn't given.
 
     Attributes:
       base: The root route that all requests are directed to.
       services: The services that are available to handlers (and the router)
+      profiler: The profiler that handlers are run through.
+      server_timing: If the timings of each request are sent in a Server-Timing header.
+      trace_exporter: The function that traces are passed to, if any.
+      cors: The configuration for cross origin requests, if any.
     """
 
-    def __init__(self, services: Dict[str, object], extensions: Dict[str, Extension]):
+    def __init__(
+        self,
+        services: Dict[str, object],
+        extensions: Dict[str, Extension],
+        server_timing: bool = False,
+        trace_exporter: TraceExporter = None,
+        cors: CORSConfig = None,
+    ):
         self._base = Route("")
         self._services = services
         self._extensions = extensions
         self._auth_services = [s for s in services.values() if s.is_auth_service]
+        self.profiler = RouteProfiler()
+        self.server_timing = server_timing
+        self.trace_exporter = trace_exporter
+        self.cors = cors
 
     async def __call__(self, request: web.BaseRequest) -> web.Response:
+        trace = RequestTrace(request)
+        try:
+            response = await self._handle(request, trace)
+        except web.HTTPException as e:
+            self._finish(trace, e.status, e)
+            raise
+        except Exception:
+            self._finish(trace, 500, None)
+            raise
+        self._finish(trace, response.status, response)
+        return response
+
+    def _finish(self, trace: RequestTrace, status: int, response: web.StreamResponse):
+        trace.finish(status)
+        if response is not None and not response.prepared:
+            if self.server_timing:
+                response.headers["Server-Timing"] = trace.server_timing()
+            if self.cors is not None:
+                self.cors.apply(trace.request, response)
+        if self.trace_exporter is not None:
+            try:
+                self.trace_exporter(trace)
+            except Exception:
+                LOGGER.exception("Trace exporter failed")
+
+    def _options(self, request: web.BaseRequest) -> Optional[web.Response]:
+        """Answer an OPTIONS request from the route tree, unless the route has
+        its own OPTIONS handler
+        """
+        route = self._base.resolve(self.split_url(request.path)[1:], {})
+        if route.handlers[Method.OPTIONS] is not None:
+            return None
+        headers = {"Allow": route.allow_header}
+        if (
+            self.cors is not None
+            and "Origin" in request.headers
+            and "Access-Control-Request-Method" in request.headers
+        ):
+            preflight = self.cors.preflight(request, route.allow_header)
+            if preflight is not None:
+                headers.update(preflight)
+        return web.Response(status=204, headers=headers)
+
+    async def _handle(
+        self, request: web.BaseRequest, trace: RequestTrace
+    ) -> web.Response:
+        # OPTIONS and CORS preflight requests don't need auth or handlers
+        if request.method == "OPTIONS":
+            with trace.span("routing"):
+                response = self._options(request)
+            if response is not None:
+                return response
         # This works as the first term in the and is evaluated before the
         # second. If the first term evalutes to false, the second term is
         # not evaluated at all
@@ -300,7 +641,8 @@ class Router:
             async def map_func(service):
                 return await service(request.headers.get("Authorization"))
 
-            auth = await async_all(await async_map(map_func, self._auth_services))
+            with trace.span("auth"):
+                auth = await async_all(await async_map(map_func, self._auth_services))
         if auth:
             LOGGER.info(
                 "Authorized request made to: %s method: %s",
@@ -310,17 +652,27 @@ class Router:
             split_url = self.split_url(request.path)
             if split_url[0] == "":
                 if self._auth_services:
-                    user = await self._auth_services[0].get_user(
-                        request.headers.get("Authorization")
-                    )
+                    with trace.span("user"):
+                        user = await self._auth_services[0].get_user(
+                            request.headers.get("Authorization")
+                        )
                 else:
                     user = None
-                if request.content_type == "application/json":
-                    data = await request.json()
-                elif request.query_string != "":
-                    data = request.query
-                else:
-                    data = (await request.content.read()).decode("UTF-8")
+                with trace.span("body"):
+                    if request.content_type == "application/json":
+                        try:
+                            data = await request.json()
+                        except ValueError:
+                            raise web.HTTPBadRequest(
+                                text=json.dumps(
+                                    {"errors": [{"field": "", "error": "invalid JSON"}]}
+                                ),
+                                content_type="application/json",
+                            )
+                    elif request.query_string != "":
+                        data = request.query
+                    else:
+                        data = (await request.content.read()).decode("UTF-8")
                 context = Context(
                     raw_request=request,
                     user_data=user,
@@ -328,8 +680,23 @@ class Router:
                     services=self._services,
                     extensions=self._extensions,
                     sent_data=data,
+                    trace=trace,
+                    cors=self.cors,
                 )
-                return await self._base(split_url[1:], Method(request.method), context)
+                with trace.span("routing"):
+                    route = self._base.resolve(split_url[1:], context.url_data)
+                    trace.template = route.template
+                    try:
+                        method = Method(request.method)
+                    except ValueError:
+                        raise route.method_not_allowed(request.method)
+                    handler = route.get_handler(method)
+                with trace.span("validate"):
+                    route.validate(method, context)
+                with trace.span("handler"):
+                    if self.profiler.active:
+                        return await self.profiler(route.template, handler, context)
+                    return await handler(context)
             # this should never happen. How does our url not start at the root?
             raise ValueError("wut?")
         LOGGER.warning(
@@ -373,17 +740,44 @@ class Router:
         """Add a handler to a route at a given url
         This method creates routes as needed to add the handler.
 
+        If the holder has a schema it is compiled here, so requests only pay
+        for running the compiled validator. The handler's signature is also
+        inspected here, to work out which url variables, services and extensions
+        to pass it, see :func:`.injection.build_plan`.
+
         Args:
           url: str: The url add the handler under
         method
             When the request has the method `method` use this handler
+
+        Raises:
+          TypeError: The schema of the holder cannot be compiled, or the handler
+            asks for an argument that can't be passed to it.
+          ValueError: The route matches the same urls as a route with handlers
+            that only differs in the names of its variables.
         """
+        validator = None
+        if holder.schema is not None:
+            validator = compile_schema(holder.schema)
         split_url = holder.split_path
+        url_variables = [
+            name
+            for name, kind in map(Route.parse_segment, split_url)
+            if kind is not None
+        ]
+        invoker = build_plan(
+            holder.func,
+            url_variables,
+            self._services,
+            self._extensions,
+            has_schema=validator is not None,
+        )
+        self._base.check_shadowing(split_url)
         try:
             route = self._base.get_route(split_url)
         except RouteDoesNotExist:
             route = self._base.add_route(split_url)
-        route.add_handler(holder)
+        route.add_handler(holder, validator, invoker)
 
     @staticmethod
     def split_url(url):
@@ -398,8 +792,8 @@ class Router:
             l.append(start + r.path)
             for child in r.children:
                 recurse_through(child, l, start + r.path + "/")
-            if r.variable_child:
-                recurse_through(r.variable_child, l, start + r.path + "/")
+            for child in r.variable_children:
+                recurse_through(child, l, start + r.path + "/")
             return l
 
         return recurse_through(self._base, [])
@@ -414,7 +808,23 @@ class HTTPServer:
         the router.
       router: The router to use for this server.
       host: The IP address to listen to requests on '0.0.0.0' for all locations.
-      port: The port to listen to requests on.
+      port: The port to listen to requests on. If it is None the server doesn't
+        listen on TCP unless :meth:`add_tcp_listener` is used.
+      server_timing: If the timings of each request should be sent back in a
+        Server-Timing header.
+      trace_exporter: A function that is called with the
+        :class:`.tracing.RequestTrace` of every finished request.
+      cors: The configuration for answering cross origin requests.
+      backlog: The default number of connections waiting to be accepted that
+        each listener queues.
+      keepalive_timeout: How many seconds an idle keep-alive connection is kept
+        open for.
+      max_line_size: The longest request line, in bytes.
+      max_field_size: The longest header, in bytes.
+      access_log: The logger to write the access log to, None to turn the
+        access log off. aiohttp's access logger is used if it isn't given.
+      access_log_format: The format of the access log lines, see
+        :ref:`aiohttp's docs <aiohttp-logging-access-log-format-spec>`.
 
     Attributes:
       router: The router that this server uses.
@@ -426,6 +836,15 @@ class HTTPServer:
         extensions: Dict[str, Extension] = None,
         host="0.0.0.0",
         port=8080,
+        server_timing: bool = False,
+        trace_exporter: TraceExporter = None,
+        cors: CORSConfig = None,
+        backlog: int = 128,
+        keepalive_timeout: float = 75.0,
+        max_line_size: int = 8190,
+        max_field_size: int = 8190,
+        access_log: Optional[logging.Logger] = access_logger,
+        access_log_format: str = web.AccessLogger.LOG_FORMAT,
     ):
         for name, ext in extensions.items():
             if not isinstance(ext, Extension):
@@ -438,32 +857,117 @@ class HTTPServer:
         if services:
             for name, service in services.items():
                 self.services[name] = service(self.extensions, self.services)
-        self.router = Router(self.services, self.extensions)
-        self._host = host
-        self._port = port
-        self._exit_event = asyncio.Event()
+        self.router = Router(
+            self.services,
+            self.extensions,
+            server_timing=server_timing,
+            trace_exporter=trace_exporter,
+            cors=cors,
+        )
+        self._backlog = backlog
+        self._server_options = {
+            "keepalive_timeout": keepalive_timeout,
+            "max_line_size": max_line_size,
+            "max_field_size": max_field_size,
+            "access_log": access_log,
+            "access_log_format": access_log_format,
+        }
+        self._listeners = []
+        if port is not None:
+            self.add_tcp_listener(host, port)
+        # created when the server starts, so it belongs to the loop it runs in
+        self._exit_event = None
         self.cogs = []
 
+    def add_tcp_listener(
+        self,
+        host: str,
+        port: int,
+        backlog: int = None,
+        reuse_port: bool = False,
+        ssl_context=None,
+    ):
+        """Listen for requests on another host and port
+
+        Args:
+          host: The IP address to listen to requests on.
+          port: The port to listen to requests on.
+          backlog: The number of connections waiting to be accepted to queue,
+            defaults to the server's backlog.
+          reuse_port: Allow other processes to listen on the same port, so the
+            kernel can balance connections between them.
+          ssl_context: Serve HTTPS with this :class:`ssl.SSLContext`.
+        """
+        self._listeners.append(
+            (
+                web.TCPSite,
+                (host, port),
+                {
+                    "backlog": backlog or self._backlog,
+                    "reuse_port": reuse_port,
+                    "ssl_context": ssl_context,
+                },
+            )
+        )
+
+    def add_unix_listener(self, path: str, backlog: int = None):
+        """Listen for requests on a Unix domain socket, e.g. for a reverse proxy
+        running on the same host
+
+        Args:
+          path: The path of the socket.
+          backlog: The number of connections waiting to be accepted to queue,
+            defaults to the server's backlog.
+        """
+        self._listeners.append(
+            (web.UnixSite, (path,), {"backlog": backlog or self._backlog})
+        )
+
+    def add_socket_listener(self, sock: socket.socket, backlog: int = None):
+        """Listen for requests on a socket that is already bound, e.g. one passed
+        in by systemd
+
+        Args:
+          sock: The socket to accept connections from.
+          backlog: The number of connections waiting to be accepted to queue,
+            defaults to the server's backlog.
+        """
+        self._listeners.append(
+            (web.SockSite, (sock,), {"backlog": backlog or self._backlog})
+        )
+
     async def __call__(self):
         """Coroutine to start running the server, use this if you want fine control."""
-        server = web.Server(self.router)
+        if not self._listeners:
+            raise ValueError("The server has nowhere to listen for requests")
+        self._exit_event = asyncio.Event()
+        server = web.Server(self.router, **self._server_options)
         runner = web.ServerRunner(server)
         await runner.setup()
-        site = web.TCPSite(runner, self._host, self._port)
+        sites = [
+            site(runner, *args, **kwargs) for site, args, kwargs in self._listeners
+        ]
 
         for extension in self.extensions.values():
             await extension(self.services, self.extensions)
-        await site.start()
-        LOGGER.info("Started HTTPServer on http://%s:%s/", self._host, self._port)
-        # Keep running the server until the exit coroutine is used
-        await self._exit_event.wait()
+        try:
+            for site in sites:
+                await site.start()
+                LOGGER.info("Started HTTPServer on %s", site.name)
+            # Keep running the server until the exit coroutine is used
+            await self._exit_event.wait()
+        finally:
+            await runner.cleanup()
 
     async def exit(self):
         """Stop the server from running
         """
-        for extension in self.extensions:
+        for extension in self.extensions.values():
             await extension.stop()
-        self._exit_event.set()
+        for service in self.services.values():
+            await service.close()
+        if self._exit_event is not None:
+            self._exit_event.set()
 
     def load_cog(self, cog: Cog):
         """Add a cog to the HTTPServer
@@ -494,28 +998,89 @@ class HTTPServer:
         """
         return self.router.get_routes()
 
-    def add_route(self, path: str, method: Method):
+    def profile(
+        self,
+        path: str,
+        duration: float = 30.0,
+        routes: List[str] = None,
+        sample_rate: float = 1.0,
+    ):
+        """Profile the handlers of the server for a while, writing the results
+        to a file that can be turned into a flame graph.
+        See :meth:`.profiling.RouteProfiler.start`
+
+        Args:
+          path: The file to write the collapsed stacks to.
+          duration: How many seconds to profile for.
+          routes: The route templates to profile, all routes if not given.
+          sample_rate: The fraction of requests to profile.
+        """
+        self.router.profiler.start(
+            path, duration=duration, routes=routes, sample_rate=sample_rate
+        )
+
+    def record_traffic(self, path: str, sample_rate: float = 1.0) -> "TrafficRecorder":
+        """Record a sample of the requests the server handles, so they can be
+        replayed later with ``python -m roamrs.loadgen replay``.
+        See :class:`.loadgen.TrafficRecorder`
+
+        Args:
+          path: The file to append the records to.
+          sample_rate: The fraction of requests to record.
+
+        Returns:
+          TrafficRecorder: The recorder, close it to stop recording.
+        """
+        # imported here so `python -m roamrs.loadgen` doesn't import itself twice
+        from .loadgen import TrafficRecorder
+
+        recorder = TrafficRecorder(path, sample_rate)
+        exporter = self.router.trace_exporter
+        if exporter is None:
+            self.router.trace_exporter = recorder
+        else:
+
+            def export(trace):
+                exporter(trace)
+                recorder(trace)
+
+            self.router.trace_exporter = export
+        return recorder
+
+    def add_route(self, path: str, method: Method, schema=None):
         """Decorator to add a handler to the server
 
         Args:
           path: The endpoint that the handler should serve
           method: The method that the handler should respond to
+          schema: A dataclass or TypedDict that the data sent to the handler must
+            match. The converted data is passed to the handler as the context's `body`
         """
 
         def route_def(func):
             if not iscoroutinefunction(func):
                 raise TypeError("handler for route must be a coroutine")
-            holder = RouteHolder(func, path, method)
+            holder = RouteHolder(func, path, method, schema=schema)
             self.router.add_handler(holder)
 
         return route_def
 
-    def run(self, loop: asyncio.AbstractEventLoop = None):
+    def run(self, loop: asyncio.AbstractEventLoop = None, use_uvloop: bool = False):
         """Ease of use function to start a server. You should normally use this.
 
         Args:
           loop: The event loop to run the server in
+          use_uvloop: Run the server in a new uvloop event loop, which is faster
+            than asyncio's own. If uvloop isn't installed asyncio's loop is used.
         """
+        if not loop and use_uvloop:
+            try:
+                import uvloop
+            except ImportError:
+                LOGGER.warning("uvloop is not installed, using the asyncio event loop")
+            else:
+                loop = uvloop.new_event_loop()
+                asyncio.set_event_loop(loop)
         if not loop:
             loop = asyncio.get_event_loop()
         loop.run_until_complete(self())
@@ -0,0 +1,135 @@
+"""This module builds injection plans for handlers.
+
+A plan is worked out once, when a handler is added to the router, from the names
+and annotations of the handler's parameters. Each request then only has to pass
+the handler exactly what it asked for:
+
+- a parameter named ``ctx`` or ``context``, or annotated with
+  :class:`.context.Context`, gets the context
+- a parameter named after a variable of the route gets its converted value
+- ``body`` gets the data checked against the route's schema, or the sent data if
+  the route has no schema
+- a parameter named after a service or extension gets it
+- ``user`` gets the user data and ``request`` the raw request
+
+A handler with a single parameter always gets the context, whatever the parameter
+is called, so handlers written as ``async def handler(request)`` work as they
+always have. Annotate the parameter with another type to have it filled in by
+name instead.
+"""
+import inspect
+
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Tuple
+
+from aiohttp import web
+
+from .context import Context
+
+__all__ = ("build_plan",)
+
+Invoker = Callable[[Context], Awaitable[web.StreamResponse]]
+
+_CONTEXT_NAMES = frozenset(("ctx", "context"))
+_CONTEXT_ANNOTATIONS = (inspect.Parameter.empty, Context, "Context")
+
+
+def _get_context(ctx):
+    return ctx
+
+
+def _get_body(ctx):
+    return ctx.body
+
+
+def _get_sent_data(ctx):
+    return ctx.sent_data
+
+
+def _get_user(ctx):
+    return ctx.user_data
+
+
+def _get_request(ctx):
+    return ctx.raw_request
+
+
+def _url_getter(name):
+    def get_url_value(ctx):
+        return ctx.url_data[name]
+
+    return get_url_value
+
+
+def build_plan(
+    func: Callable[..., Awaitable[web.StreamResponse]],
+    url_variables: Iterable[str],
+    services: Dict[str, Any],
+    extensions: Dict[str, Any],
+    has_schema: bool = False,
+) -> Invoker:
+    """Work out what to pass to each parameter of a handler
+
+    Args:
+      func: The handler.
+      url_variables: The names of the variables in the handler's route.
+      services: The services of the server.
+      extensions: The extensions of the server.
+      has_schema: If the route has a schema, so `body` is the checked data.
+
+    Returns:
+      A function that takes the context of a request and calls the handler. If the
+      handler only takes the context this is the handler itself.
+
+    Raises:
+      TypeError: A parameter of the handler can't be filled in.
+    """
+    url_variables = frozenset(url_variables)
+    parameters = [
+        p
+        for p in inspect.signature(func).parameters.values()
+        if p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD)
+    ]
+    constants: Dict[str, Any] = {}
+    getters: List[Tuple[str, Callable[[Context], Any]]] = []
+    unmatched = []
+    # A handler written as `async def handler(ctx)`, whatever it calls it
+    legacy = len(parameters) == 1 and parameters[0].annotation in _CONTEXT_ANNOTATIONS
+    for parameter in parameters:
+        name = parameter.name
+        if (
+            legacy
+            or name in _CONTEXT_NAMES
+            or parameter.annotation in (Context, "Context")
+        ):
+            getters.append((name, _get_context))
+        elif name in url_variables:
+            getters.append((name, _url_getter(name)))
+        elif name == "body":
+            getters.append((name, _get_body if has_schema else _get_sent_data))
+        elif name in services:
+            constants[name] = services[name]
+        elif name in extensions:
+            constants[name] = extensions[name]
+        elif name == "user":
+            getters.append((name, _get_user))
+        elif name == "request":
+            getters.append((name, _get_request))
+        elif parameter.default is parameter.empty:
+            unmatched.append(parameter)
+    if unmatched:
+        raise TypeError(
+            f"Can't fill in the parameters {[p.name for p in unmatched]} of handler "
+            f"{func.__qualname__}, they are not url variables, services or extensions"
+        )
+    if not constants and len(getters) == 1 and getters[0][1] is _get_context:
+        parameter = parameters[0]
+        if parameter.kind is not parameter.KEYWORD_ONLY:
+            return func
+
+    async def invoke(ctx: Context) -> web.StreamResponse:
+        kwargs = constants.copy()
+        for name, getter in getters:
+            kwargs[name] = getter(ctx)
+        return await func(**kwargs)
+
+    return invoke
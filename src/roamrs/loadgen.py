@@ -0,0 +1,376 @@
+"""This module records samples of the traffic a server receives and replays it
+against a local instance, to reproduce production load before an upgrade.
+
+Recording happens in the server, with :meth:`.httpserver.HTTPServer.record_traffic`
+or by passing a :class:`TrafficRecorder` as the server's trace exporter. Replaying
+is done from the command line::
+
+    python -m roamrs.loadgen replay traffic.jsonl --target http://127.0.0.1:8080 \\
+        --speed 2 --concurrency 50 --stub-auth 127.0.0.1:8081
+
+``--stub-auth`` starts an auth server that accepts every token, point the
+:class:`.auth.TokenValidator` of the local instance at it. The stub can also be run
+on its own with ``python -m roamrs.loadgen stub-auth``.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+
+from .tracing import RequestTrace
+
+LOGGER = logging.getLogger(__name__)
+
+__all__ = (
+    "TrafficRecorder",
+    "load_records",
+    "replay",
+    "format_report",
+    "create_stub_auth_app",
+    "main",
+)
+
+# Headers that are never written to a recording
+SECRET_HEADERS = frozenset(
+    (
+        "authorization",
+        "proxy-authorization",
+        "cookie",
+        "set-cookie",
+        "x-api-key",
+        "x-auth-token",
+        "x-csrf-token",
+    )
+)
+# Query parameters whose values are replaced in a recording
+SECRET_QUERY_PARAMS = frozenset(
+    (
+        "token",
+        "access_token",
+        "refresh_token",
+        "id_token",
+        "api_key",
+        "apikey",
+        "key",
+        "auth",
+        "password",
+        "secret",
+        "signature",
+        "sig",
+        "code",
+    )
+)
+REDACTED = "redacted"
+# Headers that are left out because the replaying client sets them itself
+_HOP_HEADERS = frozenset(("host", "content-length", "connection", "transfer-encoding"))
+UNMATCHED = "<unmatched>"
+
+
+class TrafficRecorder:
+    """A trace exporter that writes a sample of the requests a server handles to
+    a file, one JSON object per line
+
+    Each record holds the time since recording started, the method, path, route
+    template, headers (without secrets), body size, content type, status and how
+    long the request took. Bodies and secret headers are never recorded and the
+    values of secret query parameters are replaced, whether the request was
+    authorized is kept so it can be replayed with a stub token.
+
+    Args:
+      path: The file to append the records to.
+      sample_rate: The fraction of requests to record.
+    """
+
+    def __init__(self, path: str, sample_rate: float = 1.0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._file = open(path, "a")
+        self._start = time.monotonic()
+
+    def __call__(self, trace: RequestTrace):
+        if self._file is None or random.random() >= self.sample_rate:
+            return
+        request = trace.request
+        headers = {
+            name: value
+            for name, value in request.headers.items()
+            if name.lower() not in SECRET_HEADERS and name.lower() not in _HOP_HEADERS
+        }
+        record = {
+            "time": round(trace.start - self._start, 6),
+            "method": trace.method,
+            "path": _redacted_path(request),
+            "template": trace.template,
+            "headers": headers,
+            "authorized": "Authorization" in request.headers,
+            "body_size": request.content_length or 0,
+            "content_type": request.content_type,
+            "status": trace.status,
+            "duration": round(trace.duration, 6),
+        }
+        self._file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        """Stop recording and close the file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _redacted_path(request) -> str:
+    query = request.rel_url.query
+    if not any(name.lower() in SECRET_QUERY_PARAMS for name in query):
+        return request.path_qs
+    return str(
+        request.rel_url.with_query(
+            [
+                (name, REDACTED if name.lower() in SECRET_QUERY_PARAMS else value)
+                for name, value in query.items()
+            ]
+        )
+    )
+
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    """Read the records written by a :class:`TrafficRecorder`, sorted by time"""
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: r["time"])
+    return records
+
+
+def _body(record: Dict[str, Any]) -> Optional[bytes]:
+    size = record.get("body_size") or 0
+    if not size:
+        return None
+    if record.get("content_type") == "application/json" and size >= 2:
+        # keep JSON bodies parseable
+        return b"{}" + b" " * (size - 2)
+    return b"x" * size
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def replay(
+    records: Iterable[Dict[str, Any]],
+    target: str,
+    speed: float = 1.0,
+    rps: Optional[float] = None,
+    concurrency: int = 10,
+    token: str = "replay-token",
+    timeout: float = 30.0,
+) -> Dict[str, Any]:
+    """Send recorded requests to a server and measure how it copes
+
+    Args:
+      records: The records to replay, in time order.
+      target: The base url of the server, e.g. 'http://127.0.0.1:8080'.
+      speed: How much faster than recorded to send the requests.
+      rps: Send this many requests per second instead of the recorded timing.
+      concurrency: The most requests that may be in flight at once.
+      token: The Authorization header to send with requests that had one.
+      timeout: How many seconds a request may take.
+
+    Returns:
+      Dict[str, Any]: The report, with the 'duration', 'requests', 'throughput'
+        and per route template 'routes' statistics (count, errors, p50, p95 and
+        p99 latency in seconds). Latency is measured from when each request was
+        due to be sent, so it includes time spent waiting for `concurrency`.
+    """
+    target = target.rstrip("/")
+    records = list(records)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+
+    async def send(session, record, due):
+        template = record.get("template") or UNMATCHED
+        headers = dict(record.get("headers") or {})
+        if record.get("authorized"):
+            headers["Authorization"] = token
+        async with semaphore:
+            try:
+                async with session.request(
+                    record["method"],
+                    target + record["path"],
+                    headers=headers,
+                    data=_body(record),
+                ) as resp:
+                    await resp.read()
+                    failed = resp.status >= 500
+            except (ClientError, asyncio.TimeoutError):
+                failed = True
+            # Measured from when the request was due, not from when a slot freed
+            # up, so time spent queued behind `concurrency` counts as latency
+            latencies.setdefault(template, []).append(time.monotonic() - due)
+            if failed:
+                errors[template] = errors.get(template, 0) + 1
+
+    tasks = []
+    begin = time.monotonic()
+    first = records[0]["time"] if records else 0.0
+    async with ClientSession(timeout=ClientTimeout(total=timeout)) as session:
+        for i, record in enumerate(records):
+            if rps:
+                due = i / rps
+            else:
+                due = (record["time"] - first) / speed
+            delay = due - (time.monotonic() - begin)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send(session, record, begin + due)))
+        await asyncio.gather(*tasks)
+    duration = time.monotonic() - begin
+
+    routes = {}
+    for template, values in sorted(latencies.items()):
+        values.sort()
+        routes[template] = {
+            "count": len(values),
+            "errors": errors.get(template, 0),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+        }
+    return {
+        "duration": duration,
+        "requests": len(records),
+        "throughput": len(records) / duration if duration else 0.0,
+        "routes": routes,
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Format a report from :func:`replay` as a table"""
+    lines = [
+        f"{report['requests']} requests in {report['duration']:.2f}s "
+        f"({report['throughput']:.1f} req/s)",
+        "",
+        f"{'route':<40} {'count':>7} {'errors':>7} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}",
+    ]
+    for template, stats in report["routes"].items():
+        lines.append(
+            f"{template:<40} {stats['count']:>7} {stats['errors']:>7} "
+            f"{stats['p50'] * 1000:>9.2f} {stats['p95'] * 1000:>9.2f} "
+            f"{stats['p99'] * 1000:>9.2f}"
+        )
+    return "\n".join(lines)
+
+
+def create_stub_auth_app(user: Dict[str, Any] = None) -> web.Application:
+    """Create an auth server that accepts every token, for
+    :class:`.auth.TokenValidator` to use while replaying
+
+    Args:
+      user: The user '/get_user' responds with.
+    """
+    user = user if user is not None else {"id": 0, "name": "replay"}
+
+    async def verify(request):
+        return web.Response(text="OK")
+
+    async def get_user(request):
+        return web.json_response(user)
+
+    app = web.Application()
+    app.router.add_get("/verify", verify)
+    app.router.add_get("/get_user", get_user)
+    return app
+
+
+async def _start_stub_auth(address: str) -> web.AppRunner:
+    host, _, port = address.rpartition(":")
+    runner = web.AppRunner(create_stub_auth_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host or "127.0.0.1", int(port)).start()
+    LOGGER.info("Stub auth server listening on %s", address)
+    return runner
+
+
+async def _replay_command(args) -> Dict[str, Any]:
+    stub = None
+    if args.stub_auth:
+        stub = await _start_stub_auth(args.stub_auth)
+    try:
+        return await replay(
+            load_records(args.file),
+            args.target,
+            speed=args.speed,
+            rps=args.rps,
+            concurrency=args.concurrency,
+            token=args.token,
+        )
+    finally:
+        if stub is not None:
+            await stub.cleanup()
+
+
+async def _stub_auth_command(args):
+    await _start_stub_auth(args.address)
+    await asyncio.Event().wait()
+
+
+def main(argv: List[str] = None):
+    """The entry point of the ``roamrs-loadgen`` command"""
+    parser = argparse.ArgumentParser(
+        prog="roamrs-loadgen", description="Replay traffic recorded from a server"
+    )
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    replay_parser = commands.add_parser("replay", help="replay a recording")
+    replay_parser.add_argument("file", help="the recording to replay")
+    replay_parser.add_argument(
+        "--target", default="http://127.0.0.1:8080", help="the server to send to"
+    )
+    replay_parser.add_argument(
+        "--speed", type=float, default=1.0, help="how much faster than recorded"
+    )
+    replay_parser.add_argument(
+        "--rps", type=float, help="a fixed number of requests per second"
+    )
+    replay_parser.add_argument(
+        "--concurrency", type=int, default=10, help="the most requests in flight"
+    )
+    replay_parser.add_argument(
+        "--token", default="replay-token", help="the token to authorize with"
+    )
+    replay_parser.add_argument(
+        "--stub-auth", metavar="HOST:PORT", help="run a stub auth server here"
+    )
+    replay_parser.add_argument(
+        "--json", action="store_true", help="print the report as JSON"
+    )
+
+    stub_parser = commands.add_parser("stub-auth", help="run a stub auth server")
+    stub_parser.add_argument("address", nargs="?", default="127.0.0.1:8081")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "stub-auth":
+        try:
+            asyncio.run(_stub_auth_command(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    report = asyncio.run(_replay_command(args))
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    errors = sum(stats["errors"] for stats in report["routes"].values())
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
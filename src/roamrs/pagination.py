@@ -0,0 +1,238 @@
+"""This module provides cursor based pagination for list endpoints.
+
+Instead of an offset, each page ends with an opaque cursor holding the sort key of
+its last item, so fetching the next page starts right after it no matter how deep
+into the list it is.
+
+A source is a function that takes the sort key to start after (None for the first
+page) and returns an async iterator of the items after it, in order of a stable,
+unique sort key. Typically a service exposes it as an async generator:
+
+.. code-block:: python3
+
+   class ItemService(roamrs.Service):
+       ...
+
+       async def __call__(self, after=None):
+           query = "SELECT * FROM items WHERE $1::int IS NULL OR id > $1 ORDER BY id"
+           async for row in self.db.cursor(query, after):
+               yield dict(row)
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Union
+
+from aiohttp import web
+
+__all__ = ("Page", "Paginator", "Source")
+
+# Takes the key to start after, returns the items after it in key order
+Source = Callable[[Any], AsyncIterator[Any]]
+
+
+@dataclass
+class Page:
+    """A page of items
+
+    Attributes:
+      items: The items on the page.
+      next_cursor: The cursor of the next page, None if this is the last page.
+    """
+
+    items: List[Any]
+    next_cursor: Optional[str] = None
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+async def _close(iterator):
+    # Let async generators release what they hold (e.g. a database cursor)
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+class Paginator:
+    """Splits the items of a source into pages with signed cursors
+
+    Cursors are signed with `secret` so clients can't forge them, they can only
+    pass back the cursors they were given.
+
+    Args:
+      secret: The key to sign cursors with.
+      key: A function that gets the sort key of an item, the key must be JSON
+        serializable. Defaults to the item's 'id'.
+      default_limit: The number of items on a page if the client doesn't ask for
+        a number.
+      max_limit: The largest number of items a client can ask for.
+      serialize: A function that turns an item into something JSON serializable.
+    """
+
+    def __init__(
+        self,
+        secret: Union[str, bytes],
+        key: Callable[[Any], Any] = itemgetter("id"),
+        default_limit: int = 50,
+        max_limit: int = 200,
+        serialize: Callable[[Any], Any] = None,
+    ):
+        if isinstance(secret, str):
+            secret = secret.encode("UTF-8")
+        self._secret = secret
+        self.key = key
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self.serialize = serialize
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()[:16]
+
+    def encode_cursor(self, key: Any) -> str:
+        """Create a signed cursor that starts after a sort key"""
+        payload = json.dumps(key, separators=(",", ":")).encode("UTF-8")
+        return f"{_b64encode(payload)}.{_b64encode(self._sign(payload))}"
+
+    def decode_cursor(self, cursor: str) -> Any:
+        """Get the sort key from a cursor
+
+        Raises:
+          ValueError: The cursor is malformed or wasn't signed with our secret.
+        """
+        try:
+            payload, signature = cursor.split(".")
+            payload = _b64decode(payload)
+            signature = _b64decode(signature)
+        except (ValueError, binascii.Error):
+            raise ValueError("Malformed cursor")
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise ValueError("Invalid cursor")
+        return json.loads(payload)
+
+    async def page(
+        self, source: Source, cursor: Optional[str] = None, limit: int = None
+    ) -> Page:
+        """Fetch one page of items from a source
+
+        Exactly `limit` + 1 items are taken from the source, the extra one only
+        shows if there is a next page.
+
+        Args:
+          source: The source of the items.
+          cursor: The cursor of the page to fetch, None for the first page.
+          limit: The number of items on the page, defaults to `default_limit`.
+
+        Raises:
+          ValueError: The cursor is invalid.
+        """
+        after = None if cursor is None else self.decode_cursor(cursor)
+        return await self._fetch(source, after, limit)
+
+    async def _fetch(self, source: Source, after: Any, limit: Optional[int]) -> Page:
+        limit = self.default_limit if limit is None else min(limit, self.max_limit)
+        items = []
+        has_more = False
+        iterator = source(after)
+        try:
+            async for item in iterator:
+                if len(items) == limit:
+                    has_more = True
+                    break
+                items.append(item)
+        finally:
+            await _close(iterator)
+        next_cursor = None
+        if has_more and items:
+            next_cursor = self.encode_cursor(self.key(items[-1]))
+        return Page(items, next_cursor)
+
+    async def respond(self, request: web.BaseRequest, source: Source) -> web.Response:
+        """Respond with a page of items, using the 'cursor' and 'limit' query
+        parameters of the request
+
+        The response is an object with the 'items' of the page and a 'next' link
+        to the next page, which is also sent in a Link header.
+
+        Raises:
+          HTTPBadRequest: The cursor or limit is invalid.
+        """
+        query = request.query
+        limit = query.get("limit")
+        cursor = query.get("cursor")
+        try:
+            limit = None if limit is None else int(limit)
+            if limit is not None and limit < 1:
+                raise ValueError
+        except ValueError:
+            raise web.HTTPBadRequest(text="limit must be a positive integer")
+        try:
+            after = None if cursor is None else self.decode_cursor(cursor)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        # Errors from the source are bugs in the server, not bad requests
+        page = await self._fetch(source, after, limit)
+        items = page.items
+        if self.serialize is not None:
+            items = [self.serialize(item) for item in items]
+        next_url = None
+        headers = {}
+        if page.next_cursor is not None:
+            next_url = str(request.rel_url.update_query(cursor=page.next_cursor))
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        return web.json_response({"items": items, "next": next_url}, headers=headers)
+
+    async def export(
+        self,
+        request: web.BaseRequest,
+        source: Source,
+        chunk_size: int = 65536,
+        prepare: Callable[[web.StreamResponse], Awaitable[None]] = None,
+    ) -> web.StreamResponse:
+        """Stream every item of a source as newline delimited JSON, without
+        holding more than `chunk_size` bytes of it in memory
+
+        Args:
+          request: The request to respond to.
+          source: The source of the items.
+          chunk_size: How many bytes to collect before writing them out.
+          prepare: A coroutine that sends the headers of the response, such as
+            :meth:`.context.Context.prepare`. Defaults to preparing it as is.
+        """
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson; charset=utf-8"}
+        )
+        if prepare is not None:
+            await prepare(response)
+        else:
+            await response.prepare(request)
+        buffer = []
+        size = 0
+        iterator = source(None)
+        try:
+            async for item in iterator:
+                if self.serialize is not None:
+                    item = self.serialize(item)
+                line = (json.dumps(item) + "\n").encode("UTF-8")
+                buffer.append(line)
+                size += len(line)
+                if size >= chunk_size:
+                    await response.write(b"".join(buffer))
+                    buffer.clear()
+                    size = 0
+        finally:
+            await _close(iterator)
+        if buffer:
+            await response.write(b"".join(buffer))
+        await response.write_eof()
+        return response
@@ -0,0 +1,156 @@
+"""This module provides a sampling profiler that can be switched on for a running
+server to find out where the time inside handlers goes.
+"""
+import logging
+import random
+import sys
+import threading
+import time
+
+from collections import Counter
+from typing import Awaitable, Callable, Iterable, Optional
+
+from aiohttp import web
+
+from .context import Context
+
+LOGGER = logging.getLogger(__name__)
+
+__all__ = ("RouteProfiler",)
+
+
+class RouteProfiler:
+    """Samples the stacks of handlers while they run and writes them out in the
+    collapsed stack format used by flame graph tools.
+
+    The profiler does nothing until :meth:`start` is called, while it is
+    disabled the only cost to a request is checking :attr:`active`.
+
+    When started, a background thread looks at the stack of every thread each
+    `interval` seconds. Any stack that is inside a profiled handler call is
+    counted under the template of the route that the handler belongs to. After
+    `duration` seconds the counts are written to a file with one
+    ``route;frame;frame;... count`` line per unique stack.
+
+    Attributes:
+      active: If the profiler is currently collecting samples.
+    """
+
+    def __init__(self):
+        self.active = False
+        self._routes = None
+        self._sample_rate = 1.0
+        self._interval = 0.005
+        self._path = None
+        self._deadline = 0.0
+        self._samples = Counter()
+        # id of the frame of a running `_profile` call -> route template
+        self._frames = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(
+        self,
+        path: str,
+        duration: float = 30.0,
+        routes: Optional[Iterable[str]] = None,
+        sample_rate: float = 1.0,
+        interval: float = 0.005,
+    ):
+        """Start profiling handlers
+
+        Args:
+          path: The file to write the collapsed stacks to.
+          duration: How many seconds to profile for.
+          routes: The route templates to profile, e.g. '/users/{user_id}'. If not
+            given every route is profiled.
+          sample_rate: The fraction of matching requests to profile.
+          interval: How many seconds to wait between samples.
+
+        Raises:
+          RuntimeError: The profiler is already running.
+        """
+        if self.active:
+            raise RuntimeError("The profiler is already running")
+        self._routes = None if routes is None else frozenset(routes)
+        self._sample_rate = sample_rate
+        self._interval = interval
+        self._path = path
+        self._deadline = time.monotonic() + duration
+        self._samples = Counter()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="roamrs-profiler", daemon=True
+        )
+        self.active = True
+        self._thread.start()
+        LOGGER.info("Started profiling routes for %ss, writing to %s", duration, path)
+
+    def stop(self):
+        """Stop profiling early and write out what has been collected so far"""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    async def __call__(
+        self,
+        template: str,
+        handler: Callable[[Context], Awaitable[web.Response]],
+        ctx: Context,
+    ) -> web.Response:
+        """Run a handler, profiling it if it has been selected
+
+        Args:
+          template: The template of the route the handler belongs to.
+          handler: The handler to run.
+          ctx: The context to pass to the handler.
+        """
+        if (
+            self.active
+            and (self._routes is None or template in self._routes)
+            and random.random() < self._sample_rate
+        ):
+            return await self._profile(template, handler, ctx)
+        return await handler(ctx)
+
+    async def _profile(self, template, handler, ctx):
+        frame_id = id(sys._getframe())
+        self._frames[frame_id] = template
+        try:
+            return await handler(ctx)
+        finally:
+            del self._frames[frame_id]
+
+    def _sample(self):
+        own_thread = threading.get_ident()
+        profile_code = self._profile.__code__
+        while not self._stop_event.wait(self._interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    if frame.f_code is profile_code:
+                        template = self._frames.get(id(frame))
+                        if template is not None:
+                            stack.append(template)
+                            self._samples[";".join(reversed(stack))] += 1
+                        break
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+            if time.monotonic() >= self._deadline:
+                break
+        self.active = False
+        self._write()
+
+    def _write(self):
+        with open(self._path, "w") as f:
+            for stack, count in self._samples.most_common():
+                f.write(f"{stack} {count}\n")
+        LOGGER.info(
+            "Wrote %s profile samples to %s", sum(self._samples.values()), self._path
+        )
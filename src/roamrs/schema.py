@@ -0,0 +1,271 @@
+"""This module compiles request schemas into validators, so that a route can
+declare the data it expects and have it checked before the handler runs.
+
+A schema is either a dataclass or a TypedDict. The fields are converted
+according to their type annotations, strings (from query strings and the url)
+are converted to numbers and booleans where the annotation asks for them.
+"""
+import dataclasses
+import enum
+import typing
+
+from typing import Any, Callable, Dict, List, Mapping, Tuple
+
+__all__ = ("ValidationError", "compile_schema")
+
+_MISSING = object()
+_TRUE_STRINGS = frozenset(("true", "1", "yes", "on"))
+_FALSE_STRINGS = frozenset(("false", "0", "no", "off"))
+
+
+class ValidationError(Exception):
+    """An exception that is raised when data does not match a schema
+
+    Attributes:
+      errors: A list of dictionaries with the 'field' that was wrong and the
+        'error' that was found with it.
+    """
+
+    def __init__(self, errors: List[Dict[str, str]]):
+        super().__init__(errors)
+        self.errors = errors
+
+    def __repr__(self):
+        return f"ValidationError({self.errors!r})"
+
+
+class _Invalid(Exception):
+    def __init__(self, message, field=""):
+        super().__init__(message)
+        self.message = message
+        self.field = field
+
+    def prefixed(self, name):
+        field = f"{name}.{self.field}" if self.field else name
+        return _Invalid(self.message, field)
+
+
+def _is_typeddict(schema) -> bool:
+    return (
+        isinstance(schema, type)
+        and issubclass(schema, dict)
+        and hasattr(schema, "__total__")
+    )
+
+
+def _fields(schema) -> List[Tuple[str, Callable, bool]]:
+    """Get the (name, converter, required) of each field in a schema"""
+    hints = typing.get_type_hints(schema)
+    if dataclasses.is_dataclass(schema):
+        return [
+            (
+                field.name,
+                _converter(hints[field.name]),
+                field.default is dataclasses.MISSING
+                and field.default_factory is dataclasses.MISSING,
+            )
+            for field in dataclasses.fields(schema)
+            if field.init
+        ]
+    required = getattr(
+        schema, "__required_keys__", hints.keys() if schema.__total__ else ()
+    )
+    return [(name, _converter(tp), name in required) for name, tp in hints.items()]
+
+
+def _object_converter(schema) -> Callable[[Any, Mapping], Any]:
+    fields = _fields(schema)
+    build = dict if _is_typeddict(schema) else schema
+
+    def convert(data, fallback=None):
+        if not isinstance(data, Mapping):
+            raise ValidationError([{"field": "", "error": "expected an object"}])
+        kwargs = {}
+        errors = []
+        for name, converter, required in fields:
+            # The url names the resource, so the sent data can't override it
+            value = _MISSING if fallback is None else fallback.get(name, _MISSING)
+            if value is _MISSING:
+                value = data.get(name, _MISSING)
+            if value is _MISSING:
+                if required:
+                    errors.append(_Invalid("field required", name))
+                continue
+            try:
+                kwargs[name] = converter(value)
+            except _Invalid as e:
+                errors.append(e.prefixed(name))
+        if errors:
+            raise ValidationError(
+                [{"field": e.field, "error": e.message} for e in errors]
+            )
+        return build(**kwargs)
+
+    def nested(value):
+        try:
+            return convert(value)
+        except ValidationError as e:
+            # Only report the first problem of a nested object
+            raise _Invalid(e.errors[0]["error"], e.errors[0]["field"])
+
+    convert.nested = nested
+    return convert
+
+
+def _converter(tp) -> Callable[[Any], Any]:
+    """Build a function that checks and converts a value to the type `tp`"""
+    if tp is Any or tp is object:
+        return lambda value: value
+    if tp is type(None):
+
+        def convert_none(value):
+            if value is not None:
+                raise _Invalid("expected null")
+            return value
+
+        return convert_none
+    if tp is bool:
+
+        def convert_bool(value):
+            if isinstance(value, bool):
+                return value
+            if isinstance(value, str):
+                if value.lower() in _TRUE_STRINGS:
+                    return True
+                if value.lower() in _FALSE_STRINGS:
+                    return False
+            raise _Invalid("expected a boolean")
+
+        return convert_bool
+    if tp is int or tp is float:
+        name = "an integer" if tp is int else "a number"
+        accepted = int if tp is int else (int, float)
+
+        def convert_number(value):
+            if isinstance(value, accepted) and not isinstance(value, bool):
+                return tp(value)
+            if isinstance(value, str):
+                try:
+                    return tp(value)
+                except ValueError:
+                    pass
+            raise _Invalid(f"expected {name}")
+
+        return convert_number
+    if tp is str:
+
+        def convert_str(value):
+            if not isinstance(value, str):
+                raise _Invalid("expected a string")
+            return value
+
+        return convert_str
+    if isinstance(tp, type) and issubclass(tp, enum.Enum):
+
+        def convert_enum(value):
+            try:
+                return tp(value)
+            except ValueError:
+                raise _Invalid(
+                    "expected one of " + ", ".join(repr(m.value) for m in tp)
+                )
+
+        return convert_enum
+    if dataclasses.is_dataclass(tp) or _is_typeddict(tp):
+        return _object_converter(tp).nested
+
+    origin = getattr(tp, "__origin__", None)
+    args = getattr(tp, "__args__", None) or ()
+    if origin is typing.Union:
+        converters = [_converter(arg) for arg in args]
+        optional = type(None) in args
+
+        def convert_union(value):
+            if value is None and optional:
+                return None
+            error = None
+            for converter in converters:
+                try:
+                    return converter(value)
+                except _Invalid as e:
+                    error = error or e
+            raise error
+
+        return convert_union
+    if origin in (list, set, frozenset) or tp is list:
+        container = origin or tp
+        item = _converter(args[0]) if args else _converter(Any)
+
+        def convert_list(value):
+            if not isinstance(value, list):
+                raise _Invalid("expected a list")
+            items = []
+            for i, x in enumerate(value):
+                try:
+                    items.append(item(x))
+                except _Invalid as e:
+                    raise e.prefixed(str(i))
+            return items if container is list else container(items)
+
+        return convert_list
+    if origin in (dict, Dict) or tp is dict:
+        key, val = (
+            (_converter(args[0]), _converter(args[1]))
+            if args
+            else (_converter(Any), _converter(Any))
+        )
+
+        def convert_dict(value):
+            if not isinstance(value, Mapping):
+                raise _Invalid("expected an object")
+            result = {}
+            for k, v in value.items():
+                try:
+                    result[key(k)] = val(v)
+                except _Invalid as e:
+                    raise e.prefixed(str(k))
+            return result
+
+        return convert_dict
+    if isinstance(tp, type):
+
+        def convert_instance(value):
+            if not isinstance(value, tp):
+                raise _Invalid(f"expected {tp.__name__}")
+            return value
+
+        return convert_instance
+    raise TypeError(f"Unsupported type {tp!r} in schema")
+
+
+def compile_schema(schema) -> Callable[[Any, Mapping], Any]:
+    """Compile a schema into a validator
+
+    This is done once when a handler is registered, the returned function only
+    has to walk a precomputed list of fields for each request.
+
+    Args:
+      schema: A dataclass or TypedDict describing the data a route accepts.
+
+    Returns:
+      A function that takes the sent data and the url data of a request and
+      returns an instance of the schema. Fields in the url data are taken from
+      it, whatever the sent data holds, the rest from the sent data. A request without a body (None or an empty
+      string) counts as an empty object. It raises :class:`ValidationError` if the data
+      does not match the schema.
+
+    Raises:
+      TypeError: The schema is not a dataclass or TypedDict, or contains a type
+        that cannot be validated.
+    """
+    if not (dataclasses.is_dataclass(schema) or _is_typeddict(schema)):
+        raise TypeError(f"{schema!r} is not a dataclass or TypedDict")
+    convert = _object_converter(schema)
+
+    def validate(data, fallback=None):
+        # The router passes the decoded body, an empty string if nothing was sent
+        if data is None or data == "":
+            data = {}
+        return convert(data, fallback)
+
+    return validate
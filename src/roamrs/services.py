@@ -49,6 +49,9 @@ class Service(AbstractService, metaclass=ServiceMeta):
     def is_auth_service(self):
         return self._AUTH_SERVICE
 
+    async def close(self):
+        """Release anything the service holds, called when the server exits"""
+
 
 class AuthService(Service):
     _AUTH_SERVICE = True
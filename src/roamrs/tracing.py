@@ -0,0 +1,124 @@
+"""This module provides the trace that records how long each phase of a request
+took, so slow requests can be broken down into auth, parsing, routing, the
+handler and serialization.
+"""
+from time import perf_counter
+from typing import Callable, List, Optional, Tuple
+
+from aiohttp import web
+
+__all__ = ("RequestTrace", "TraceExporter")
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: "RequestTrace", name: str):
+        self.trace = trace
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.record(self.name, self.start)
+        return False
+
+
+class RequestTrace:
+    """The timings of the phases of a single request
+
+    The router records the phases 'auth', 'user', 'body', 'routing', 'validate'
+    and 'handler', and :meth:`.context.Context.respond` records 'serialize'.
+    Handlers can add their own spans through the context:
+
+    .. code-block:: python3
+
+       with ctx.trace.span("db"):
+           rows = await ctx.services["db"].fetch()
+
+    Spans can overlap, e.g. 'serialize' happens inside 'handler'. Timings come
+    from :func:`time.perf_counter`.
+
+    Args:
+      request: The request being traced.
+
+    Attributes:
+      request: The request being traced.
+      method: The method of the request.
+      path: The path of the request.
+      template: The template of the route that handled the request, None if no
+        route was found.
+      status: The status of the response, None until the request is finished.
+      start: When the request started.
+      end: When the request finished, None until it is finished.
+      spans: A list of (name, start, end) tuples.
+    """
+
+    __slots__ = (
+        "request",
+        "method",
+        "path",
+        "template",
+        "status",
+        "start",
+        "end",
+        "spans",
+    )
+
+    def __init__(self, request: web.BaseRequest):
+        self.request = request
+        self.method = request.method
+        self.path = request.path
+        self.template = None
+        self.status = None
+        self.start = perf_counter()
+        self.end = None
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def span(self, name: str) -> _Span:
+        """Time the body of a with statement
+
+        Args:
+          name: The name of the span, it must be a valid HTTP token to be sent
+            in the Server-Timing header.
+        """
+        return _Span(self, name)
+
+    def record(self, name: str, start: float, end: Optional[float] = None):
+        """Record a span that has already happened
+
+        Args:
+          name: The name of the span.
+          start: When the span started, from :func:`time.perf_counter`.
+          end: When the span ended, defaults to now.
+        """
+        self.spans.append((name, start, perf_counter() if end is None else end))
+
+    def finish(self, status: int):
+        """Mark the request as finished
+
+        Args:
+          status: The status of the response.
+        """
+        self.status = status
+        self.end = perf_counter()
+
+    @property
+    def duration(self) -> float:
+        """The number of seconds the request took, or has taken so far"""
+        return (perf_counter() if self.end is None else self.end) - self.start
+
+    def server_timing(self) -> str:
+        """Format the spans as the value of a Server-Timing header"""
+        metrics = [
+            f"{name};dur={(end - start) * 1000:.3f}" for name, start, end in self.spans
+        ]
+        metrics.append(f"total;dur={self.duration * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+# A function that is called with the trace of every finished request
+TraceExporter = Callable[[RequestTrace], None]
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from aiohttp import test_utils, web
+
+from roamrs.auth import (
+    CircuitBreaker,
+    CircuitState,
+    OpenCircuitPolicy,
+    TokenValidator,
+)
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4, reset_timeout=0)
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.state is CircuitState.CLOSED
+    breaker.record_failure()
+    # 2 out of 4 failed, it opens, but reset_timeout is 0 so it's half open
+    assert breaker.state is CircuitState.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    breaker.reset_timeout = 60
+    assert breaker.state is CircuitState.OPEN
+    assert not breaker.allow()
+    breaker.reset_timeout = 0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state is CircuitState.CLOSED
+
+
+def test_circuit_breaker_trials():
+    breaker = CircuitBreaker(min_calls=1, reset_timeout=0, half_open_calls=2)
+    breaker.record_failure()
+    assert breaker.state is CircuitState.HALF_OPEN
+    assert breaker.allow()
+    assert breaker.allow()
+    breaker.record_success()
+    # the finished trial doesn't let a third one through
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.state is CircuitState.HALF_OPEN
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state is CircuitState.CLOSED
+
+
+def test_token_validator_cancelled():
+    async def backend(request):
+        await asyncio.sleep(10)
+        return web.Response()
+
+    async def run():
+        async with test_utils.RawTestServer(backend) as server:
+            breaker = CircuitBreaker(min_calls=1)
+            validator = TokenValidator(str(server.make_url("")), breaker=breaker)(
+                None, None
+            )
+            for _ in range(5):
+                task = asyncio.ensure_future(validator("good"))
+                await asyncio.sleep(0.05)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+            assert breaker.state is CircuitState.CLOSED
+
+    asyncio.run(run())
+
+
+def test_token_validator_open_policies():
+    healthy = True
+
+    async def backend(request):
+        if not healthy:
+            return web.Response(status=502)
+        if request.headers["Authorization"] == "good":
+            return web.json_response({"id": 1})
+        return web.Response(status=401)
+
+    async def run():
+        nonlocal healthy
+        async with test_utils.RawTestServer(backend) as server:
+            url = str(server.make_url(""))
+            cached = TokenValidator(
+                url, open_policy=OpenCircuitPolicy.SERVE_CACHED, grace=60
+            )(None, None)
+            fail_fast = TokenValidator(url)(None, None)
+            assert await cached("good") is True
+            assert await cached.get_user("good") == {"id": 1}
+            assert await cached("bad") is False
+            healthy = False
+            assert await cached("good") is True
+            assert await cached.get_user("good") == {"id": 1}
+            assert await cached("bad") is False
+            with pytest.raises(web.HTTPServiceUnavailable):
+                await cached("unknown")
+            with pytest.raises(web.HTTPServiceUnavailable):
+                await fail_fast("good")
+
+    asyncio.run(run())
@@ -0,0 +1,121 @@
+import asyncio
+
+from aiohttp import ClientSession, WSCloseCode, WSMsgType, test_utils
+
+import roamrs
+
+from roamrs import BroadcastHub
+
+
+def test_hub_fan_out():
+    async def run():
+        hub = BroadcastHub(max_buffer=2)
+        first = hub.subscribe(["news", "sport"])
+        second = hub.subscribe("news")
+        assert hub.publish("news", {"a": 1}, event="update") == 2
+        assert hub.publish("weather", "sunny") == 0
+        a, b = await first.get(), await second.get()
+        # the message is shared, so it is only serialized once
+        assert a is b
+        assert a.text == '{"a": 1}'
+        assert a.sse == b'event: update\ndata: {"a": 1}\n\n'
+        second.close()
+        assert await second.get() is None
+        assert hub.subscribers("news") == 1
+        await hub.stop()
+        assert [m async for m in first] == []
+
+    asyncio.run(run())
+
+
+def test_hub_drops_slow_consumers():
+    async def run():
+        hub = BroadcastHub()
+        slow = hub.subscribe("news", max_buffer=1)
+        fast = hub.subscribe("news", max_buffer=5)
+        assert hub.publish("news", 1) == 2
+        assert hub.publish("news", 2) == 1
+        assert slow.dropped and slow.closed
+        assert hub.subscribers("news") == 1
+        assert [(await fast.get()).data for _ in range(2)] == [1, 2]
+
+    asyncio.run(run())
+
+
+def _server(hub):
+    server = roamrs.HTTPServer(extensions={"hub": hub}, port=None)
+
+    @server.add_route("/events", roamrs.Method.GET)
+    async def events(ctx):
+        return await ctx.event_stream(hub.subscribe("news"), heartbeat=0.05)
+
+    @server.add_route("/ws", roamrs.Method.GET)
+    async def ws(ctx):
+        return await ctx.websocket(hub.subscribe("news"))
+
+    @server.add_route("/slow", roamrs.Method.GET)
+    async def slow(ctx):
+        return await ctx.websocket(hub.subscribe("news", max_buffer=1))
+
+    return server
+
+
+async def _wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def test_websocket_receives_messages():
+    async def run():
+        hub = BroadcastHub()
+        async with test_utils.RawTestServer(_server(hub).router) as test_server:
+            async with ClientSession() as session:
+                async with session.ws_connect(test_server.make_url("/ws")) as ws:
+                    await _wait_for(lambda: hub.subscribers("news") == 1)
+                    hub.publish("news", {"a": 1})
+                    assert await ws.receive_str(timeout=1) == '{"a": 1}'
+            await _wait_for(lambda: hub.subscribers("news") == 0)
+
+    asyncio.run(run())
+
+
+def test_event_stream_cleaned_up_after_disconnect():
+    async def run():
+        hub = BroadcastHub()
+        async with test_utils.RawTestServer(_server(hub).router) as test_server:
+            async with ClientSession() as session:
+                resp = await session.get(test_server.make_url("/events"))
+                assert resp.headers["Content-Type"] == "text/event-stream"
+                await _wait_for(lambda: hub.subscribers("news") == 1)
+                hub.publish("news", "hello", event="greeting")
+                lines = []
+                while b"data: hello\n" not in lines:
+                    lines.append(await resp.content.readline())
+                assert b"event: greeting\n" in lines
+                resp.close()
+            await _wait_for(lambda: hub.subscribers("news") == 0)
+
+    asyncio.run(run())
+
+
+def test_slow_websocket_closed_with_try_again_later():
+    async def run():
+        hub = BroadcastHub()
+        async with test_utils.RawTestServer(_server(hub).router) as test_server:
+            async with ClientSession() as session:
+                async with session.ws_connect(test_server.make_url("/slow")) as ws:
+                    await _wait_for(lambda: hub.subscribers("news") == 1)
+                    hub.publish("news", 1)
+                    # the second message doesn't fit, so the consumer is dropped
+                    assert hub.publish("news", 2) == 0
+                    message = await ws.receive(timeout=1)
+                    while message.type is WSMsgType.TEXT:
+                        message = await ws.receive(timeout=1)
+                    assert message.type is WSMsgType.CLOSE
+                    assert ws.close_code == WSCloseCode.TRY_AGAIN_LATER
+            await _wait_for(lambda: hub.subscribers("news") == 0)
+
+    asyncio.run(run())
@@ -0,0 +1,79 @@
+import fcntl
+import os
+import time
+
+import pytest
+
+from roamrs import SharedAuthCache
+
+
+def test_shared_cache(tmp_path):
+    path = str(tmp_path / "cache")
+    cache = SharedAuthCache(path, slots=16, value_size=64)
+    other = SharedAuthCache(path, slots=16, value_size=64)
+    assert cache.get("verify", "token") == (False, None)
+    assert cache.set("verify", "token", True)
+    assert cache.set("get_user", "token", {"id": 1})
+    assert other.get("verify", "token") == (True, True)
+    assert other.get("get_user", "token") == (True, {"id": 1})
+    assert not cache.set("get_user", "big", "a" * 100)
+    other.clear()
+    assert cache.get("verify", "token") == (False, None)
+    cache.close()
+    other.close()
+
+
+def test_shared_cache_expiry(tmp_path):
+    cache = SharedAuthCache(str(tmp_path / "cache"), slots=4, value_size=16)
+    cache.set("verify", "token", False, ttl=-1)
+    assert cache.get("verify", "token") == (False, None)
+    assert cache.get("verify", "token", grace=60) == (True, False)
+    for i in range(10):
+        cache.set("verify", str(i), True)
+    assert cache.get("verify", "9") == (True, True)
+    with pytest.raises(ValueError):
+        SharedAuthCache(str(tmp_path / "cache"), slots=8, value_size=16)
+    cache.close()
+
+
+def test_shared_cache_torn_slot(tmp_path):
+    cache = SharedAuthCache(str(tmp_path / "cache"), slots=1, value_size=16)
+    cache.set("verify", "token", True)
+    offset = cache._FILE_HEADER.size
+    # a writer died half way through the slot, leaving its counter odd
+    seq = cache._SEQ.unpack_from(cache._map, offset)[0]
+    cache._SEQ.pack_into(cache._map, offset, seq + 1)
+    assert cache.get("verify", "token") == (False, None)
+    assert cache.set("verify", "token", False)
+    assert cache._SEQ.unpack_from(cache._map, offset)[0] % 2 == 0
+    assert cache.get("verify", "token") == (True, False)
+    cache.close()
+
+
+def test_shared_cache_lock_excludes_forked_workers(tmp_path):
+    cache = SharedAuthCache(str(tmp_path / "cache"), slots=4, value_size=16)
+    cache._lock()
+    pid = os.fork()
+    if pid == 0:
+        # the child inherited the descriptor but must not get the lock
+        try:
+            fcntl.lockf(cache._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os._exit(0)
+        os._exit(1)
+    _, status = os.waitpid(pid, 0)
+    cache._unlock()
+    cache.close()
+    assert os.WEXITSTATUS(status) == 0
+
+
+def test_shared_cache_file_permissions(tmp_path):
+    path = tmp_path / "cache"
+    path.touch()
+    path.chmod(0o666)
+    with pytest.raises(PermissionError):
+        SharedAuthCache(str(path))
+    link = tmp_path / "link"
+    link.symlink_to(tmp_path / "elsewhere")
+    with pytest.raises(PermissionError):
+        SharedAuthCache(str(link))
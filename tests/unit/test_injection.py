@@ -0,0 +1,90 @@
+import asyncio
+
+from dataclasses import dataclass
+
+import pytest
+
+from aiohttp import ClientSession, test_utils, web
+
+import roamrs
+
+
+class Greeter(roamrs.Service):
+    def __init__(self, extensions, services, greeting):
+        self.greeting = greeting
+
+    def __call__(self, name):
+        return f"{self.greeting} {name}"
+
+
+@dataclass
+class Rename:
+    name: str
+
+
+def test_injection_plan():
+    server = roamrs.HTTPServer(
+        services={"greeter": Greeter("hello")}, extensions={}, port=None
+    )
+
+    @server.add_route("/items/{item_id:int}", roamrs.Method.GET)
+    async def get_item(ctx, item_id, greeter):
+        return ctx.respond({"id": item_id, "greeting": greeter("you")})
+
+    @server.add_route("/items/{item_id:int}", roamrs.Method.PATCH, schema=Rename)
+    async def rename_item(ctx, body, item_id):
+        return ctx.respond({"id": item_id, "name": body.name})
+
+    @server.add_route("/legacy", roamrs.Method.GET)
+    async def legacy(request_context):
+        return request_context.respond(
+            request_context.services["greeter"]("legacy"), content_type="text/plain"
+        )
+
+    # the legacy handler is called directly, without an extra layer
+    route = server.router._base.get_route(["legacy"])
+    assert route.invokers[roamrs.Method.GET] is route.handlers[roamrs.Method.GET]
+
+    # single parameters get the context whatever they are called
+    @server.add_route("/items/{item_id:int}/name", roamrs.Method.GET)
+    async def get_name(request):
+        return request.respond({"id": request.url_data["item_id"]})
+
+    # unless they are annotated with something else
+    @server.add_route("/items/{item_id:int}/id", roamrs.Method.GET)
+    async def get_id(item_id: int):
+        return web.json_response({"id": item_id})
+
+    class Items(roamrs.Cog):
+        @roamrs.route("/cog/{body}", roamrs.Method.GET)
+        async def get(self, body):
+            return body.respond({"cog": body.url_data["body"]})
+
+    server.load_cog(Items())
+
+    with pytest.raises(TypeError):
+
+        @server.add_route("/broken/{item_id}", roamrs.Method.GET)
+        async def broken(ctx, item_id, database):
+            pass
+
+    async def run():
+        async with test_utils.RawTestServer(server.router) as test_server:
+            async with ClientSession() as session:
+                async with session.get(test_server.make_url("/items/3")) as resp:
+                    assert await resp.json() == {"id": 3, "greeting": "hello you"}
+                async with session.patch(
+                    test_server.make_url("/items/3"), json={"name": "new"}
+                ) as resp:
+                    assert await resp.json() == {"id": 3, "name": "new"}
+                async with session.get(test_server.make_url("/legacy")) as resp:
+                    assert await resp.text() == "hello legacy"
+                url = test_server.make_url("/items/4/name")
+                async with session.get(url) as resp:
+                    assert await resp.json() == {"id": 4}
+                async with session.get(test_server.make_url("/items/5/id")) as resp:
+                    assert await resp.json() == {"id": 5}
+                async with session.get(test_server.make_url("/cog/x")) as resp:
+                    assert await resp.json() == {"cog": "x"}
+
+    asyncio.run(run())
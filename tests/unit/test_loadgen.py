@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from aiohttp import ClientSession, test_utils, web
+
+import roamrs
+from roamrs.auth import TokenValidator
+from roamrs.loadgen import create_stub_auth_app, format_report, load_records, replay
+
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+    headers = {"Authorization": "secret-token", "X-Test": "1"}
+
+    async def run():
+        async with test_utils.TestServer(create_stub_auth_app()) as auth_server:
+            auth_url = str(auth_server.make_url(""))
+            server = roamrs.HTTPServer(
+                services={"auth": TokenValidator(auth_url)}, extensions={}
+            )
+
+            @server.add_route("/items/{item_id:int}", roamrs.Method.GET)
+            async def get_item(ctx):
+                return ctx.respond({"id": ctx.url_data["item_id"]})
+
+            @server.add_route("/items", roamrs.Method.POST)
+            async def post_item(ctx):
+                return ctx.respond(ctx.sent_data)
+
+            recorder = server.record_traffic(path)
+            async with test_utils.RawTestServer(server.router) as test_server:
+                url = str(test_server.make_url(""))
+                async with ClientSession(headers=headers) as session:
+                    for i in range(3):
+                        (await session.get(f"{url}/items/{i}?token=hush&a={i}")).close()
+                    (await session.post(f"{url}/items", json={"a": 1})).close()
+                    (await session.get(f"{url}/nowhere")).close()
+                recorder.close()
+                records = load_records(path)
+                try:
+                    return records, await replay(records, url, speed=100)
+                finally:
+                    await server.exit()
+
+    records, report = asyncio.run(run())
+    assert len(records) == 5
+    assert "secret-token" not in json.dumps(records)
+    assert "hush" not in json.dumps(records)
+    assert records[1]["path"] == "/items/1?token=redacted&a=1"
+    assert records[0]["headers"]["X-Test"] == "1"
+    assert records[3]["body_size"] == len(json.dumps({"a": 1}))
+    assert report["requests"] == 5
+    routes = report["routes"]
+    assert routes["/items/{item_id:int}"]["count"] == 3
+    assert routes["/items"]["errors"] == 0
+    assert routes["<unmatched>"]["count"] == 1
+    assert "/items/{item_id:int}" in format_report(report)
+
+
+def test_replay_counts_queueing_as_latency():
+    async def slow(request):
+        await asyncio.sleep(0.05)
+        return web.Response()
+
+    records = [{"time": 0.0, "method": "GET", "path": "/"} for _ in range(5)]
+
+    async def run():
+        async with test_utils.RawTestServer(slow) as server:
+            url = str(server.make_url("")).rstrip("/")
+            return await replay(records, url, rps=1000, concurrency=1)
+
+    stats = asyncio.run(run())["routes"]["<unmatched>"]
+    # the last request waited for the four before it
+    assert stats["p99"] >= 0.2
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientSession, test_utils
+
+import roamrs
+from roamrs.pagination import Paginator
+
+ITEMS = [{"id": i} for i in range(1, 8)]
+
+
+def test_pages():
+    fetched = []
+
+    async def source(after):
+        for item in ITEMS:
+            if after is None or item["id"] > after:
+                fetched.append(item["id"])
+                yield item
+
+    async def run():
+        paginator = Paginator("secret", default_limit=3)
+        first = await paginator.page(source)
+        assert [i["id"] for i in first.items] == [1, 2, 3]
+        # only one item more than the page is taken from the source
+        assert fetched == [1, 2, 3, 4]
+        second = await paginator.page(source, first.next_cursor)
+        assert [i["id"] for i in second.items] == [4, 5, 6]
+        last = await paginator.page(source, second.next_cursor)
+        assert [i["id"] for i in last.items] == [7]
+        assert last.next_cursor is None
+        with pytest.raises(ValueError):
+            await Paginator("other").page(source, first.next_cursor)
+        with pytest.raises(ValueError):
+            await paginator.page(source, "garbage")
+
+    asyncio.run(run())
+
+
+def test_paginated_routes():
+    paginator = Paginator("secret", default_limit=5)
+    server = roamrs.HTTPServer(extensions={})
+
+    async def source(after):
+        for item in ITEMS:
+            if after is None or item["id"] > after:
+                yield item
+
+    @server.add_route("/items", roamrs.Method.GET)
+    async def get_items(ctx):
+        return await ctx.paginate(paginator, source)
+
+    async def broken_source(after):
+        raise ValueError("a bug")
+        yield
+
+    @server.add_route("/broken", roamrs.Method.GET)
+    async def get_broken(ctx):
+        return await ctx.paginate(paginator, broken_source)
+
+    @server.add_route("/items/export", roamrs.Method.GET)
+    async def export_items(ctx):
+        return await ctx.stream_export(paginator, source)
+
+    async def run():
+        async with test_utils.RawTestServer(server.router) as test_server:
+            async with ClientSession() as session:
+                async with session.get(test_server.make_url("/items?limit=4")) as r:
+                    first = await r.json()
+                    assert r.headers["Link"] == f'<{first["next"]}>; rel="next"'
+                async with session.get(test_server.make_url(first["next"])) as r:
+                    second = await r.json()
+                async with session.get(test_server.make_url("/items?cursor=x")) as r:
+                    assert r.status == 400
+                async with session.get(test_server.make_url("/items?limit=0")) as r:
+                    assert r.status == 400
+                # a bug in the source is not the client's fault
+                async with session.get(test_server.make_url("/broken")) as r:
+                    assert r.status == 500
+                async with session.get(test_server.make_url("/items/export")) as r:
+                    lines = (await r.text()).splitlines()
+        assert first["items"] + second["items"] == ITEMS
+        assert second["next"] is None
+        assert len(lines) == len(ITEMS)
+
+    asyncio.run(run())
@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+from roamrs.profiling import RouteProfiler
+
+
+def test_profiler_writes_collapsed_stacks(tmp_path):
+    path = tmp_path / "profile.txt"
+    profiler = RouteProfiler()
+
+    def spin():
+        end = time.monotonic() + 0.2
+        while time.monotonic() < end:
+            pass
+
+    async def handler(ctx):
+        spin()
+        return ctx
+
+    async def run():
+        profiler.start(str(path), duration=10, routes=["/busy"], interval=0.001)
+        assert await profiler("/busy", handler, "busy") == "busy"
+        assert await profiler("/idle", handler, "idle") == "idle"
+        profiler.stop()
+
+    asyncio.run(run())
+    assert not profiler.active
+    lines = path.read_text().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith("/busy;handler ")
+        assert int(count) > 0
+    assert any("spin" in line for line in lines)
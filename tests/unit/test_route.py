@@ -0,0 +1,88 @@
+from uuid import UUID
+
+import pytest
+from aiohttp import web
+
+from roamrs import Method, Route, Router
+from roamrs.cog import RouteHolder
+
+
+async def handler(ctx):
+    pass
+
+
+def add(root, path, method=Method.GET):
+    root.add_route(path.split("/")[1:]).add_handler(RouteHolder(handler, path, method))
+
+
+def test_typed_routes():
+    root = Route("")
+    add(root, "/items/{slug}")
+    add(root, "/items/{id:int}")
+    add(root, "/items/{id:uuid}")
+    add(root, "/items/{code:[A-Z]{3}}")
+    add(root, "/items/new")
+    add(root, "/items/{id:int}/edit")
+    add(root, "/items/{slug}/view")
+    assert [r.segment for r in root.get_route(["items"]).variable_children] == [
+        "{id:int}",
+        "{id:uuid}",
+        "{code:[A-Z]{3}}",
+        "{slug}",
+    ]
+
+    def resolve(path):
+        url_data = {}
+        route = root.resolve(path.split("/")[1:], url_data)
+        return route.template, url_data
+
+    assert resolve("/items/new") == ("/items/new", {})
+    assert resolve("/items/12") == ("/items/{id:int}", {"id": 12})
+    uuid = "12345678-1234-5678-1234-567812345678"
+    assert resolve(f"/items/{uuid}") == ("/items/{id:uuid}", {"id": UUID(uuid)})
+    assert resolve("/items/ABC") == ("/items/{code:[A-Z]{3}}", {"code": "ABC"})
+    assert resolve("/items/abc") == ("/items/{slug}", {"slug": "abc"})
+    assert resolve("/items/12/edit") == ("/items/{id:int}/edit", {"id": 12})
+    # 12 matches {id:int} first, but only {slug} has a 'view' child
+    assert resolve("/items/12/view") == ("/items/{slug}/view", {"slug": "12"})
+    with pytest.raises(web.HTTPNotFound):
+        resolve("/items/abc/edit")
+
+
+def test_remove_typed_route():
+    root = Route("")
+    add(root, "/items/{id:int}/edit")
+    add(root, "/items/{slug}")
+    assert root.remove_route(["items", "{id:int}", "edit"])
+    assert [r.segment for r in root.get_route(["items"]).variable_children] == [
+        "{slug}"
+    ]
+    assert not root.remove_route(["items", "{id:int}"])
+
+
+def test_invalid_routes():
+    for segment in ("{}", "{id:}", "{id:[}", "-"):
+        with pytest.raises(ValueError):
+            Route(segment)
+
+
+def test_shadowed_variable_route():
+    router = Router({}, {})
+    router.add_handler(RouteHolder(handler, "/items/{id}", Method.GET))
+    router.add_handler(RouteHolder(handler, "/items/{id:int}", Method.GET))
+    router.add_handler(RouteHolder(handler, "/items/{slug}/view", Method.GET))
+    router.add_handler(RouteHolder(handler, "/items/{id}", Method.POST))
+    with pytest.raises(ValueError):
+        router.add_handler(RouteHolder(handler, "/items/{slug}", Method.GET))
+    with pytest.raises(ValueError):
+        router.add_handler(RouteHolder(handler, "/items/{num:int}", Method.GET))
+    # deeper variables shadow each other too
+    router.add_handler(RouteHolder(handler, "/a/{x}/b", Method.GET))
+    with pytest.raises(ValueError):
+        router.add_handler(RouteHolder(handler, "/a/{y}/b", Method.POST))
+    router.add_handler(RouteHolder(handler, "/a/{y}/c", Method.POST))
+    with pytest.raises(ValueError):
+        router.add_handler(RouteHolder(handler, "/a/{x}/c", Method.GET))
+    router.add_handler(RouteHolder(handler, "/a/{x}/{p}/d", Method.GET))
+    with pytest.raises(ValueError):
+        router.add_handler(RouteHolder(handler, "/a/{y}/{q}/d", Method.PATCH))
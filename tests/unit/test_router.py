@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from aiohttp import ClientSession, UnixConnector, test_utils, web
+
+import roamrs
+
+from roamrs.pagination import Paginator
+
+
+def test_head_and_options():
+    calls = []
+    server = roamrs.HTTPServer(
+        extensions={}, cors=roamrs.CORSConfig(["https://example.com"])
+    )
+
+    @server.add_route("/items", roamrs.Method.GET)
+    async def get_items(ctx):
+        calls.append(ctx.raw_request.method)
+        return ctx.respond([1, 2, 3])
+
+    @server.add_route("/name", roamrs.Method.GET)
+    async def get_name(ctx):
+        return ctx.respond("items", content_type="text/plain")
+
+    @server.add_route("/items", roamrs.Method.POST)
+    async def post_items(ctx):
+        calls.append(ctx.raw_request.method)
+        return ctx.respond({})
+
+    async def request(session, method, path, **kwargs):
+        async with session.request(method, path, **kwargs) as resp:
+            return resp.status, resp.headers, await resp.read()
+
+    async def run():
+        async with test_utils.RawTestServer(server.router) as test_server:
+            url = test_server.make_url("/items")
+            async with ClientSession() as session:
+                status, headers, body = await request(session, "HEAD", url)
+                assert (status, body) == (200, b"")
+                assert headers["Content-Type"].startswith("application/json")
+
+                name_url = test_server.make_url("/name")
+                _, get_headers, _ = await request(session, "GET", name_url)
+                _, headers, _ = await request(session, "HEAD", name_url)
+                assert headers["Content-Type"] == get_headers["Content-Type"]
+
+                status, headers, _ = await request(session, "OPTIONS", url)
+                assert status == 204
+                assert headers["Allow"] == "GET, HEAD, OPTIONS, POST"
+
+                preflight = {
+                    "Origin": "https://example.com",
+                    "Access-Control-Request-Method": "POST",
+                }
+                status, headers, _ = await request(
+                    session, "OPTIONS", url, headers=preflight
+                )
+                assert status == 204
+                assert headers["Access-Control-Allow-Origin"] == "https://example.com"
+                assert headers["Access-Control-Allow-Methods"] == headers["Allow"]
+
+                status, headers, _ = await request(session, "PUT", url)
+                assert status == 405
+                assert headers["Allow"] == "GET,HEAD,OPTIONS,POST"
+
+                status, _, _ = await request(
+                    session, "OPTIONS", test_server.make_url("/nowhere")
+                )
+                assert status == 404
+
+    asyncio.run(run())
+    # OPTIONS requests never reach the handlers
+    assert calls == ["HEAD"]
+
+
+def test_multiple_listeners(tmp_path):
+    path = str(tmp_path / "roamrs.sock")
+    server = roamrs.HTTPServer(extensions={}, port=None, keepalive_timeout=5)
+    server.add_unix_listener(path)
+    port = test_utils.unused_port()
+    server.add_tcp_listener("127.0.0.1", port)
+
+    @server.add_route("/ping", roamrs.Method.GET)
+    async def ping(ctx):
+        return ctx.respond("pong", content_type="text/plain")
+
+    async def run():
+        task = asyncio.ensure_future(server())
+        await asyncio.sleep(0.1)
+        try:
+            async with ClientSession(connector=UnixConnector(path)) as session:
+                async with session.get("http://localhost/ping") as resp:
+                    assert await resp.text() == "pong"
+            async with ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/ping") as resp:
+                    assert await resp.text() == "pong"
+        finally:
+            await server.exit()
+            await task
+
+    asyncio.run(run())
+
+
+def test_cors_on_streaming_responses():
+    hub = roamrs.BroadcastHub()
+    server = roamrs.HTTPServer(extensions={}, port=None, cors=roamrs.CORSConfig("*"))
+    paginator = Paginator("secret")
+
+    async def source(after):
+        yield {"id": 1}
+
+    @server.add_route("/events", roamrs.Method.GET)
+    async def events(ctx):
+        subscription = hub.subscribe("news")
+        subscription.close()
+        return await ctx.event_stream(subscription)
+
+    @server.add_route("/export", roamrs.Method.GET)
+    async def export(ctx):
+        return await ctx.stream_export(paginator, source)
+
+    async def run():
+        async with test_utils.RawTestServer(server.router) as test_server:
+            async with ClientSession() as session:
+                for path in ("/events", "/export"):
+                    async with session.get(
+                        test_server.make_url(path),
+                        headers={"Origin": "https://example.com"},
+                    ) as resp:
+                        await resp.read()
+                        assert resp.headers["Access-Control-Allow-Origin"] == "*"
+
+    asyncio.run(run())
+
+
+def test_cors_credentials_need_listed_origins():
+    with pytest.raises(ValueError):
+        roamrs.CORSConfig("*", allow_credentials=True)
+    cors = roamrs.CORSConfig(["https://example.com"], allow_credentials=True)
+    response = web.Response()
+    request = test_utils.make_mocked_request(
+        "GET", "/", headers={"Origin": "https://evil.example"}
+    )
+    cors.apply(request, response)
+    assert "Access-Control-Allow-Origin" not in response.headers
+    assert "Access-Control-Allow-Credentials" not in response.headers
@@ -0,0 +1,107 @@
+import asyncio
+
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import pytest
+
+from aiohttp import ClientSession, test_utils
+
+import roamrs
+
+from roamrs.schema import ValidationError, compile_schema
+
+try:
+    from typing import TypedDict
+except ImportError:  # Python 3.7
+    TypedDict = None
+
+
+@dataclass
+class Tag:
+    name: str
+
+
+@dataclass
+class Item:
+    id: int
+    name: str
+    price: float = 0.0
+    public: bool = True
+    tags: List[Tag] = field(default_factory=list)
+    note: Optional[str] = None
+
+
+def test_dataclass_schema():
+    validate = compile_schema(Item)
+    item = validate({"name": "a", "price": 2, "tags": [{"name": "t"}]}, {"id": "3"})
+    assert item == Item(3, "a", 2.0, True, [Tag("t")])
+    assert validate({"id": "1", "name": "b", "public": "false"}).public is False
+    with pytest.raises(ValidationError) as e:
+        validate({"id": "x", "tags": [{}]})
+    assert e.value.errors == [
+        {"field": "id", "error": "expected an integer"},
+        {"field": "name", "error": "field required"},
+        {"field": "tags.0.name", "error": "field required"},
+    ]
+    with pytest.raises(ValidationError):
+        validate("not an object")
+
+
+@pytest.mark.skipif(TypedDict is None, reason="TypedDict requires Python 3.8")
+def test_typeddict_schema():
+    class Query(TypedDict):
+        page: int
+        search: str
+
+    validate = compile_schema(Query)
+    assert validate({"page": "2", "search": "x"}) == {"page": 2, "search": "x"}
+    with pytest.raises(ValidationError):
+        validate({"page": 2})
+
+
+def test_invalid_schema():
+    with pytest.raises(TypeError):
+        compile_schema(int)
+
+
+@dataclass
+class ItemQuery:
+    item_id: int
+    verbose: bool = False
+
+
+def test_schema_without_body():
+    server = roamrs.HTTPServer(extensions={}, port=None)
+
+    @server.add_route("/items/{item_id:int}", roamrs.Method.GET, schema=ItemQuery)
+    async def get_item(ctx):
+        return ctx.respond({"id": ctx.body.item_id, "verbose": ctx.body.verbose})
+
+    @server.add_route("/items/{item_id:int}", roamrs.Method.PATCH, schema=ItemQuery)
+    async def patch_item(ctx):
+        return ctx.respond({"id": ctx.body.item_id})
+
+    async def run():
+        async with test_utils.RawTestServer(server.router) as test_server:
+            async with ClientSession() as session:
+                async with session.get(test_server.make_url("/items/3")) as resp:
+                    assert resp.status == 200
+                    assert await resp.json() == {"id": 3, "verbose": False}
+                url = test_server.make_url("/items/3?verbose=1")
+                async with session.get(url) as resp:
+                    assert await resp.json() == {"id": 3, "verbose": True}
+                # the url names the item, the sent data can't change it
+                url = test_server.make_url("/items/3?item_id=999")
+                async with session.get(url) as resp:
+                    assert (await resp.json())["id"] == 3
+                url = test_server.make_url("/items/3")
+                async with session.patch(url, json={"item_id": 42}) as resp:
+                    assert await resp.json() == {"id": 3}
+                async with session.patch(
+                    url, data="{nope", headers={"Content-Type": "application/json"}
+                ) as resp:
+                    assert resp.status == 400
+                    assert (await resp.json())["errors"][0]["error"] == "invalid JSON"
+
+    asyncio.run(run())
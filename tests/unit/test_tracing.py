@@ -0,0 +1,45 @@
+import asyncio
+
+from aiohttp import ClientSession, test_utils
+
+import roamrs
+from roamrs.tracing import RequestTrace
+
+
+def test_server_timing_and_exporter():
+    traces = []
+    server = roamrs.HTTPServer(
+        extensions={}, server_timing=True, trace_exporter=traces.append
+    )
+
+    @server.add_route("/items/{item_id:int}", roamrs.Method.GET)
+    async def get_item(ctx):
+        with ctx.trace.span("db"):
+            await asyncio.sleep(0)
+        return ctx.respond({"id": ctx.url_data["item_id"]})
+
+    async def run():
+        async with test_utils.RawTestServer(server.router) as test_server:
+            async with ClientSession() as session:
+                async with session.get(test_server.make_url("/items/1")) as resp:
+                    assert resp.status == 200
+                    timing = resp.headers["Server-Timing"]
+                async with session.get(test_server.make_url("/nowhere")) as resp:
+                    assert resp.status == 404
+        return timing
+
+    timing = asyncio.run(run())
+    names = [metric.split(";")[0] for metric in timing.split(", ")]
+    assert names == [
+        "body",
+        "routing",
+        "validate",
+        "db",
+        "serialize",
+        "handler",
+        "total",
+    ]
+    ok, missing = traces
+    assert isinstance(ok, RequestTrace)
+    assert (ok.template, ok.status) == ("/items/{item_id:int}", 200)
+    assert (missing.template, missing.status) == (None, 404)